@@ -1,3 +1,4 @@
-import rpc
+# rpc is imported on first use, see criu.py
 import images
 from criu import *
+from criu import rpc
@@ -9,7 +9,23 @@ import signal
 import sys
 import struct
 
-import rpc
+class _lazy_rpc(object):
+	"""
+	Imports the rpc module (and the protobuf code with it) on
+	first use, so that users of pycriu.images, like crit, don't
+	pay for it. Stays pycriu.rpc after that and passes attribute
+	lookups on to the module.
+	"""
+	def __getattr__(self, name):
+		global rpc
+		import rpc as mod
+		rpc = mod
+		return getattr(mod, name)
+
+	def __repr__(self):
+		return "<lazy module 'pycriu.rpc'>"
+
+rpc = _lazy_rpc()
 
 class _criu_comm:
 	"""
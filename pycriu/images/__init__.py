@@ -1,3 +1,6 @@
 from magic import *
 from images import *
 from pb import *
+import bindict
+import pages
+from imgdir import ImageDir
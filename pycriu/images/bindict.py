@@ -0,0 +1,105 @@
+import marshal
+import struct
+
+# bindict is a compact binary alternative to json for criu images
+# in dict form. It keeps the very same dicts pb2dict produces, but
+# stores them with marshal, so that ints (e.g. hex and flags fields)
+# stay native numbers and extras' binary data is kept as is rather
+# than in base64. The format is:
+#
+# BINDICT   ::= HEAD MAGIC { ENTRY }
+# HEAD      ::= "CRBD" VERSION
+# MAGIC     ::= RECORD with image magic name
+# ENTRY     ::= RECORD with entry dict
+# RECORD    ::= SIZE "marshal-ed data"
+#
+# VERSION   ::= "32 bit integer, marshal version used"
+# SIZE      ::= "32 bit integer, equals the data length"
+#
+# Marshal format may differ between python versions, so bindict
+# images are meant for piping data between tools, not for keeping.
+
+bindict_head = 'CRBD'
+
+class BinDictException(Exception):
+	pass
+
+def _plain(value):
+	# Raw extras read via mmap_file are buffers, which
+	# marshal doesn't know about
+	if isinstance(value, buffer):
+		return str(value)
+	elif isinstance(value, dict):
+		return dict((k, _plain(v)) for k, v in value.iteritems())
+	elif isinstance(value, list):
+		return map(_plain, value)
+	else:
+		return value
+
+def _dump_record(value, f):
+	try:
+		data = marshal.dumps(value, marshal.version)
+	except ValueError:
+		data = marshal.dumps(_plain(value), marshal.version)
+
+	f.write(struct.pack('i', len(data)))
+	f.write(data)
+
+def _load_record(f):
+	buf = f.read(4)
+	if not buf:
+		return None
+
+	size, = struct.unpack('i', buf)
+	data = f.read(size)
+	if len(data) != size:
+		raise BinDictException("Truncated record")
+
+	return marshal.loads(data)
+
+def dump(img, f):
+	"""
+	Write criu image in dict form to f in bindict format.
+	Entries of the image may be a generator.
+	"""
+	f.write(bindict_head)
+	f.write(struct.pack('i', marshal.version))
+	_dump_record(img['magic'], f)
+	for entry in img['entries']:
+		_dump_record(entry, f)
+
+def _iter_entries(f):
+	while True:
+		entry = _load_record(f)
+		if entry is None:
+			break
+		yield entry
+
+def iter_load(f):
+	"""
+	Read criu image in dict form from bindict file. Entries
+	of the returned image is a generator, that reads them one
+	by one.
+	"""
+	head = f.read(len(bindict_head) + 4)
+	if len(head) != len(bindict_head) + 4 or not head.startswith(bindict_head):
+		raise BinDictException("Not a bindict image")
+
+	version, = struct.unpack('i', head[len(bindict_head):])
+	if version > marshal.version:
+		raise BinDictException("Unsupported marshal version %d" % version)
+
+	img = {}
+	img['magic'] = _load_record(f)
+	img['entries'] = _iter_entries(f)
+
+	return img
+
+def load(f):
+	"""
+	Same as iter_load(), but reads all entries at once.
+	"""
+	img = iter_load(f)
+	img['entries'] = list(img['entries'])
+
+	return img
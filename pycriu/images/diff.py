@@ -0,0 +1,325 @@
+# This file compares two directories of images, e.g. consecutive
+# pre-dumps or dumps of the same service taken on different nodes.
+#
+# Images, that are in both directories and have the same size, are
+# compared by hashes of their contents first, and byte-identical ones
+# are not decoded at all. Entries of changed images are matched by
+# keys -- processes by pid, fds by fd number, files by id and VMAs by
+# start address -- and are reported as added, removed or changed, the
+# latter with old and new values of the fields that differ. Images
+# without such keys, or with keys shared by several entries, are
+# compared entry by entry. Pagemaps are compared as sets of page
+# ranges, and the contents of pages present in both are compared
+# too, so that modified ranges are reported as well.
+# In_parent pages without the parent images are reported as unknown.
+import io
+import os
+import re
+import hashlib
+
+import images
+import pages
+
+hash_chunk = 1 << 20
+
+# Keys entries of images are matched by, tuples of fields for
+# entries, that share ids (e.g. targets of the same eventpoll file).
+# Images not listed here are keyed by 'id' if their entries have
+# it. Keys, that are not unique in either image, are not used.
+entry_keys = {
+	'PSTREE':		'pid',
+	'FDINFO':		'fd',
+	'EVENTPOLL_TFD':	('id', 'tfd'),
+	'INOTIFY_WD':		('id', 'wd'),
+}
+
+def _hash(path):
+	h = hashlib.sha1()
+	f = io.open(path, 'rb')
+	while True:
+		data = f.read(hash_chunk)
+		if not data:
+			break
+		h.update(data)
+	f.close()
+	return h.digest()
+
+def _identical(a, b):
+	if os.path.getsize(a) != os.path.getsize(b):
+		return False
+	return _hash(a) == _hash(b)
+
+def _fields_diff(a, b):
+	"""
+	Returns {field: [old, new]} for the fields of the
+	two entries, that differ.
+	"""
+	d = {}
+	for k in set(a) | set(b):
+		if a.get(k) != b.get(k):
+			d[k] = [a.get(k), b.get(k)]
+	return d
+
+def _key(e, key):
+	if isinstance(key, tuple):
+		return tuple(e.get(k) for k in key)
+	return e.get(key)
+
+def _unique(entries, key):
+	keys = set(_key(e, key) for e in entries)
+	return len(keys) == len(entries)
+
+def _keyed_diff(a, b, key):
+	"""
+	Matches entries of the two lists by the key field (or tuple
+	of fields), or by position if key is None, and returns the
+	differences.
+	"""
+	if key is None:
+		ka = dict(enumerate(a))
+		kb = dict(enumerate(b))
+	else:
+		ka = dict((_key(e, key), e) for e in a)
+		kb = dict((_key(e, key), e) for e in b)
+
+	d = {'added': [], 'removed': [], 'changed': []}
+	for k in sorted(set(ka) | set(kb)):
+		if k not in kb:
+			d['removed'].append(ka[k])
+		elif k not in ka:
+			d['added'].append(kb[k])
+		elif ka[k] != kb[k]:
+			d['changed'].append({'key': k,
+				'fields': _fields_diff(ka[k], kb[k])})
+
+	if key is None:
+		d['key'] = 'index'
+	else:
+		d['key'] = key
+	return d
+
+def _entries_diff(m, a, b):
+	key = entry_keys.get(m)
+	if key is None and a + b and all('id' in e for e in a + b):
+		key = 'id'
+	if key is not None and not (_unique(a, key) and _unique(b, key)):
+		key = None
+	return _keyed_diff(a, b, key)
+
+def _mm_diff(a, b):
+	"""
+	VMAs are matched by their start addresses, the rest of
+	mm fields are compared as is.
+	"""
+	a = a and a[0] or {}
+	b = b and b[0] or {}
+	va = a.pop('vmas', [])
+	vb = b.pop('vmas', [])
+
+	return {'fields': _fields_diff(a, b),
+		'vmas': _keyed_diff(va, vb, 'start')}
+
+#
+# Page ranges are lists of [start, end) address pairs, sorted
+# and not overlapping
+#
+def _pagemap_ranges(path):
+	f = images.mmap_file(io.open(path, 'rb'))
+	images.get_magic(f)
+	pages_id, cols = images.pagemap_handler().load_columns(f)
+
+	ranges = []
+	for vaddr, nr in zip(cols['vaddr'], cols['nr_pages']):
+		end = vaddr + nr * pages.PAGE_SIZE
+		if ranges and ranges[-1][1] == vaddr:
+			ranges[-1][1] = end
+		else:
+			ranges.append([vaddr, end])
+	return ranges
+
+def _subtract(xs, ys):
+	res = []
+	j = 0
+	for start, end in xs:
+		while j < len(ys) and ys[j][1] <= start:
+			j += 1
+		k = j
+		while start < end:
+			if k >= len(ys) or ys[k][0] >= end:
+				res.append([start, end])
+				break
+			if ys[k][0] > start:
+				res.append([start, ys[k][0]])
+			start = max(start, ys[k][1])
+			k += 1
+	return res
+
+def _intersect(xs, ys):
+	res = []
+	i = j = 0
+	while i < len(xs) and j < len(ys):
+		start = max(xs[i][0], ys[j][0])
+		end = min(xs[i][1], ys[j][1])
+		if start < end:
+			res.append([start, end])
+		if xs[i][1] < ys[j][1]:
+			i += 1
+		else:
+			j += 1
+	return res
+
+def _add_range(ranges, start, end):
+	if ranges and ranges[-1][1] == start:
+		ranges[-1][1] = end
+	else:
+		ranges.append([start, end])
+
+def _modified(pa, pb, ranges):
+	"""
+	Returns ranges of pages, whose contents differ in the
+	two dumps, and ranges, that can't be compared, as their
+	pages are in_parent and the parent images are missing.
+	Ranges are compared in chunks, and only the chunks that
+	differ or can't be read as a whole are compared page by page.
+	"""
+	res = []
+	unknown = []
+	chunk = 256 * pages.PAGE_SIZE
+	for start, end in ranges:
+		for off in xrange(start, end, chunk):
+			n = min(chunk, end - off)
+			try:
+				da = pa.read(off, n)
+				db = pb.read(off, n)
+			except (pages.PagesException, IOError, OSError):
+				da = db = None
+
+			if da is not None and da == db:
+				continue
+
+			for p in xrange(off, off + n, pages.PAGE_SIZE):
+				if da is None:
+					try:
+						pga = pa.read(p, pages.PAGE_SIZE)
+						pgb = pb.read(p, pages.PAGE_SIZE)
+					except (pages.PagesException, IOError, OSError):
+						_add_range(unknown, p, p + pages.PAGE_SIZE)
+						continue
+				else:
+					pga = da[p - off:p - off + pages.PAGE_SIZE]
+					pgb = db[p - off:p - off + pages.PAGE_SIZE]
+
+				if pga != pgb:
+					_add_range(res, p, p + pages.PAGE_SIZE)
+	return res, unknown
+
+def _pagemap_diff(dir_a, dir_b, name):
+	ra = _pagemap_ranges(os.path.join(dir_a, name))
+	rb = _pagemap_ranges(os.path.join(dir_b, name))
+
+	d = {'added': _subtract(rb, ra), 'removed': _subtract(ra, rb)}
+
+	# pagemap-<pid>.img, contents are compared, if pages are there
+	pid = int(name[len('pagemap-'):-len('.img')])
+	pa = pb = None
+	try:
+		pa = pages.open(dir_a, pid)
+		pb = pages.open(dir_b, pid)
+		d['modified'], d['unknown'] = _modified(pa, pb,
+						_intersect(ra, rb))
+	except (IOError, OSError):
+		pass
+	finally:
+		if pa:
+			pa.close()
+		if pb:
+			pb.close()
+
+	return d
+
+def _pages_path(pagemap):
+	f = images.mmap_file(io.open(pagemap, 'rb'))
+	head = next(images.iter_load(f)['entries'])
+	return os.path.join(os.path.dirname(pagemap),
+			'pages-%d.img' % head['pages_id'])
+
+def _pages_identical(pagemap_a, pagemap_b):
+	pa = _pages_path(pagemap_a)
+	pb = _pages_path(pagemap_b)
+	if not os.path.exists(pa) or not os.path.exists(pb):
+		return os.path.exists(pa) == os.path.exists(pb)
+	return _identical(pa, pb)
+
+def _magic(path):
+	f = io.open(path, 'rb')
+	try:
+		return images.get_magic(f)
+	except images.MagicException:
+		return None
+	finally:
+		f.close()
+
+def _load(path):
+	f = images.mmap_file(io.open(path, 'rb'))
+	return images.load(f)['entries']
+
+def image_diff(dir_a, dir_b, name):
+	"""
+	Returns the differences between the image in two directories,
+	or None if the images are identical.
+	"""
+	pa = os.path.join(dir_a, name)
+	pb = os.path.join(dir_b, name)
+	pm = re.match(r'pagemap-\d+\.img$', name)
+	# Same pagemap may describe changed pages
+	if _identical(pa, pb) and (not pm or _pages_identical(pa, pb)):
+		return None
+
+	ma = _magic(pa)
+	mb = _magic(pb)
+	if ma != mb:
+		return {'magic': [ma, mb]}
+
+	d = {'magic': ma}
+	if ma is None or isinstance(images.handlers[ma], images.raw_handler):
+		# Changes of pages are reported by pagemap diffs,
+		# the rest of raw data is not decoded
+		d['size'] = [os.path.getsize(pa), os.path.getsize(pb)]
+	elif ma == 'PAGEMAP' and pm:
+		d.update(_pagemap_diff(dir_a, dir_b, name))
+	elif ma == 'MM':
+		d.update(_mm_diff(_load(pa), _load(pb)))
+	else:
+		d.update(_entries_diff(ma, _load(pa), _load(pb)))
+
+	return d
+
+def _image_names(path):
+	return set(name for name in os.listdir(path)
+			if name.endswith('.img') and
+			os.path.isfile(os.path.join(path, name)))
+
+def diff(dir_a, dir_b):
+	"""
+	Compares images in the two directories. Returns a dict with
+	the names of images found in only one of them, the number of
+	identical images and the differences of the changed ones.
+	"""
+	na = _image_names(dir_a)
+	nb = _image_names(dir_b)
+
+	d = {
+		'only_a':	sorted(na - nb),
+		'only_b':	sorted(nb - na),
+		'identical':	0,
+		'changed':	{},
+	}
+
+	for name in sorted(na & nb):
+		idiff = image_diff(dir_a, dir_b, name)
+		if idiff is None:
+			d['identical'] += 1
+		else:
+			d['changed'][name] = idiff
+
+	return d
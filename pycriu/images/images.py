@@ -41,13 +41,18 @@
 #
 import io
 import google
+from google.protobuf.descriptor import FieldDescriptor as FD
 import struct
 import os
+import stat
 import sys
 import json
 import pb2dict
 import array
-
+import base64
+import mmap
+import itertools
+import re
 import magic
 from pb import *
 
@@ -61,10 +66,107 @@ sizeof_u64 = 8
 def round_up(x,y):
 	return (((x - 1) | (y - 1)) + 1)
 
+# Entries index is kept in arrays of this type. Python 2 array
+# has no 'Q', but 'L' is 64 bit wide on 64 bit hosts.
+index_fmt = 'L'
+
 class MagicException(Exception):
 	def __init__(self, magic):
 		self.magic = magic
 
+# Read-only file-like object, that walks an mmap-ed image instead
+# of calling read() on the file for every SIZE and PAYLOAD.
+class mapped_file:
+	"""
+	Maps the whole image file into memory and implements read(),
+	seek() and tell() on top of the mapping. read() returns buffer
+	objects pointing into the mapping, so neither payloads nor
+	extras are copied before they get parsed or encoded.
+	"""
+	def __init__(self, f, size):
+		self.name	= getattr(f, 'name', None)
+		self.pos	= 0
+		self.size	= size
+		if self.size:
+			self.map = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+		else:
+			# Empty files can't be mmap-ed
+			self.map = ''
+
+	def read(self, size = -1):
+		if size < 0 or self.pos + size > self.size:
+			size = max(self.size - self.pos, 0)
+		buf = buffer(self.map, self.pos, size)
+		self.pos += size
+		return buf
+
+	def seek(self, off, whence = 0):
+		if whence == 1:
+			off += self.pos
+		elif whence == 2:
+			off += self.size
+		self.pos = max(off, 0)
+
+	def tell(self):
+		return self.pos
+
+	def close(self):
+		if self.size:
+			self.map.close()
+
+def mmap_file(f):
+	"""
+	Returns mapped_file for f, if it is a regular file, and f
+	itself otherwise, as pipes, fifos and the like can't be
+	mmap-ed and their size is not known in advance.
+	"""
+	try:
+		st = os.fstat(f.fileno())
+	except (AttributeError, IOError, OSError, ValueError):
+		return f
+
+	if not stat.S_ISREG(st.st_mode):
+		return f
+
+	return mapped_file(f, st.st_size)
+
+# Write-only file-like object, that gathers small writes of entry
+# sizes, payloads and extras and passes them to the real file in
+# big chunks. There's no writev() in python 2, so chunks are joined.
+class batch_writer:
+	"""
+	Batches writes to f up to chunk_size bytes. Data that is
+	big enough by itself goes straight to f. flush() must be
+	called once everything is written.
+	"""
+	chunk_size = 1 << 20
+
+	def __init__(self, f):
+		self.f		= f
+		self.parts	= []
+		self.size	= 0
+
+	def write(self, data):
+		if len(data) >= self.chunk_size:
+			self.flush()
+			self.f.write(data)
+			return
+
+		if not isinstance(data, str):
+			# Buffers from mmap_file can't be joined
+			data = str(data)
+
+		self.parts.append(data)
+		self.size += len(data)
+		if self.size >= self.chunk_size:
+			self.flush()
+
+	def flush(self):
+		if self.parts:
+			self.f.write(''.join(self.parts))
+			self.parts = []
+			self.size = 0
+
 # Generic class to handle loading/dumping criu images entries from/to bin
 # format to/from dict(json).
 class entry_handler:
@@ -79,53 +181,113 @@ class entry_handler:
 		self.payload		= payload
 		self.extra_handler	= extra_handler
 
-	def load(self, f, pretty = False):
+	def iter_entries(self, f, pretty = False, start = 0, raw = False,
+			fields = None, skip_extra = False, blobs = None):
 		"""
-		Convert criu image entries from binary format to dict(json).
-		Takes a file-like object and returnes a list with entries in
-		dict(json) format.
+		Convert criu image entries from binary format to dict(json)
+		one by one. Takes a file-like object and yields entries in
+		dict(json) format, so that the whole image never has to be
+		kept in memory. Start is the number of the entry f is
+		positioned at.
+
+		With raw set, entries are yielded as protobuf messages
+		(or as (message, extra) tuples, if the image has extras)
+		with binary data of extras left as is.
+
+		Fields limits dict(json) conversion to the listed fields
+		(see pb2dict), and with skip_extra set extras are seeked
+		over instead of being read, and are not returned at all.
+
+		Blobs is the codec for binary data of extras, by default
+		it is base64_blobs, or raw_blobs in raw mode.
 		"""
-		entries = []
+		if blobs is None:
+			if raw:
+				blobs = raw_blobs()
+			else:
+				blobs = base64_blobs()
+
+		if fields is not None and not pretty and not raw and \
+				not self.extra_handler:
+			# Few fields of entries without extras are picked
+			# right from the wire, the rest is not parsed at all
+			plan = _wire_plan(self.payload.DESCRIPTOR, fields)
+			while True:
+				buf = f.read(4)
+				if not buf:
+					break
+				size, = struct.unpack('i', buf)
+				yield _wire_decode(bytearray(f.read(size)), plan)
+			return
 
 		while True:
-			entry = {}
-
 			# Read payload
 			pb = self.payload()
 			buf = f.read(4)
-			if buf == '':
+			if not buf:
 				break
 			size, = struct.unpack('i', buf)
 			pb.ParseFromString(f.read(size))
-			entry = pb2dict.pb2dict(pb, pretty)
+			if raw:
+				entry = pb
+			else:
+				entry = pb2dict.pb2dict(pb, pretty, fields = fields)
 
 			# Read extra
 			if self.extra_handler:
-				entry['extra'] = self.extra_handler.load(f, pb)
+				if skip_extra:
+					self.extra_handler.skip(f, pb)
+					extra = None
+				else:
+					extra = self.extra_handler.load(f, pb, blobs, raw)
+
+				if raw:
+					entry = (pb, extra)
+				elif not skip_extra:
+					entry['extra'] = extra
 
-			entries.append(entry)
+			yield entry
 
-		return entries
+	def load(self, f, pretty = False, raw = False, fields = None,
+			skip_extra = False, blobs = None):
+		"""
+		Convert criu image entries from binary format to dict(json).
+		Takes a file-like object and returnes a list with entries in
+		dict(json) format.
+		"""
+		return list(self.iter_entries(f, pretty, 0, raw, fields,
+					skip_extra, blobs))
 
-	def loads(self, s, pretty = False):
+	def loads(self, s, pretty = False, raw = False):
 		"""
 		Same as load(), but takes a string as an argument.
 		"""
 		f = io.BytesIO(s)
-		return self.load(f, pretty)
+		return self.load(f, pretty, raw)
 
-	def dump(self, entries, f):
+	def dump(self, entries, f, blobs = None):
 		"""
 		Convert criu image entries from dict(json) format to binary.
 		Takes a list of entries and a file-like object to write entries
-		in binary format to.
+		in binary format to. Entries may also be protobuf messages or
+		(message, extra) tuples, as loaded in raw mode. Blobs is the
+		codec extras were loaded with, see iter_entries().
 		"""
+		f = batch_writer(f)
 		for entry in entries:
-			extra = entry.pop('extra', None)
+			if isinstance(entry, dict):
+				extra = entry.pop('extra', None)
+				pb = self.payload()
+				pb2dict.dict2pb(entry, pb)
+				eblobs = blobs or base64_blobs()
+			else:
+				if isinstance(entry, tuple):
+					pb, extra = entry
+				else:
+					pb, extra = entry, None
+				eblobs = blobs or raw_blobs()
 
 			# Write payload
-			pb = self.payload()
-			pb2dict.dict2pb(entry, pb)
 			pb_str = pb.SerializeToString()
 			size = len(pb_str)
 			f.write(struct.pack('i', size))
@@ -133,7 +295,9 @@ class entry_handler:
 
 			# Write extra
 			if self.extra_handler and extra:
-				self.extra_handler.dump(extra, f, pb)
+				self.extra_handler.dump(extra, f, pb, eblobs)
+
+		f.flush()
 
 	def dumps(self, entries):
 		"""
@@ -142,23 +306,42 @@ class entry_handler:
 		"""
 		f = io.BytesIO('')
 		self.dump(entries, f)
-		return f.read()
+		return f.getvalue()
 
-	def count(self, f):
+	def index(self, f):
 		"""
-		Counts the number of top-level object in the image file
+		Walks through the image entries without converting them
+		and returns an index_fmt array with offset, size of payload
+		and size of extra for each of them.
 		"""
-		entries = 0
+		idx = array.array(index_fmt)
 
 		while True:
+			off = f.tell()
 			buf = f.read(4)
-			if buf == '':
+			if not buf:
 				break
 			size, = struct.unpack('i', buf)
-			f.seek(size, 1)
-			entries += 1
+			if self.extra_handler:
+				pb = self.payload()
+				pb.ParseFromString(f.read(size))
+				self.extra_handler.skip(f, pb)
+			else:
+				f.seek(size, 1)
+			idx.extend((off, size, f.tell() - off - 4 - size))
 
-		return entries
+		return idx
+
+	def count(self, f, nr = None):
+		"""
+		Counts the number of top-level object in the image file.
+		If the number of entries in the index of the image is
+		known, no reading is done.
+		"""
+		if nr is None:
+			nr = len(self.index(f)) / 3
+
+		return nr
 
 # Special handler for pagemap.img
 class pagemap_handler:
@@ -167,30 +350,42 @@ class pagemap_handler:
 	that it has a header of pagemap_head type followed by entries
 	of pagemap_entry type.
 	"""
-	def load(self, f, pretty = False):
-		entries = []
-
-		pb = pagemap_head()
+	def iter_entries(self, f, pretty = False, start = 0, raw = False,
+			fields = None, skip_extra = False, blobs = None):
+		if start == 0:
+			pb = pagemap_head()
+		else:
+			pb = pagemap_entry()
 		while True:
 			buf = f.read(4)
-			if buf == '':
+			if not buf:
 				break
 			size, = struct.unpack('i', buf)
 			pb.ParseFromString(f.read(size))
-			entries.append(pb2dict.pb2dict(pb, pretty))
+			if raw:
+				yield pb
+			else:
+				yield pb2dict.pb2dict(pb, pretty, fields = fields)
 
 			pb = pagemap_entry()
 
-		return entries
+	def load(self, f, pretty = False, raw = False, fields = None,
+			skip_extra = False, blobs = None):
+		return list(self.iter_entries(f, pretty, 0, raw, fields,
+					skip_extra, blobs))
 
-	def loads(self, s, pretty = False):
+	def loads(self, s, pretty = False, raw = False):
 		f = io.BytesIO(s)
-		return self.load(f, pretty)
+		return self.load(f, pretty, raw)
 
-	def dump(self, entries, f):
+	def dump(self, entries, f, blobs = None):
+		f = batch_writer(f)
 		pb = pagemap_head()
 		for item in entries:
-			pb2dict.dict2pb(item, pb)
+			if isinstance(item, dict):
+				pb2dict.dict2pb(item, pb)
+			else:
+				pb = item
 			pb_str = pb.SerializeToString()
 			size = len(pb_str)
 			f.write(struct.pack('i', size))
@@ -198,73 +393,361 @@ class pagemap_handler:
 
 			pb = pagemap_entry()
 
+		f.flush()
+
 	def dumps(self, entries):
 		f = io.BytesIO('')
 		self.dump(entries, f)
-		return f.read()
+		return f.getvalue()
 
-	def count(self, f):
-		return entry_handler(None).count(f) - 1
+	def index(self, f):
+		return entry_handler(None).index(f)
 
+	def count(self, f, nr = None):
+		return entry_handler(None).count(f, nr) - 1
+
+	def load_columns(self, f):
+		"""
+		Fast path for big pagemaps. Decodes pagemap_entry-s
+		right from the varints, without creating a message per
+		entry, and returns (pages_id, columns), where columns is
+		a dict of parallel vaddr, nr_pages and in_parent arrays.
+		Entries with fields we don't know about go the slow way.
+		"""
+		buf = bytearray(f.read())
+		end = len(buf)
+
+		vaddr = array.array(index_fmt)
+		nr_pages = array.array('I')
+		in_parent = array.array('B')
+		pages_id = None
+
+		pos = 0
+		while pos < end:
+			size, = struct.unpack_from('i', buf, pos)
+			pos += 4
+			pe_end = pos + size
+
+			vals = [0, 0, 0, 0]
+			while pos < pe_end:
+				tag = buf[pos]
+				if tag not in (0x08, 0x10, 0x18):
+					break
+				v, pos = _decode_varint(buf, pos + 1)
+				vals[tag >> 3] = v
+
+			if pos != pe_end:
+				pb = pagemap_entry() if pages_id != None else pagemap_head()
+				pb.ParseFromString(str(buf[pe_end - size:pe_end]))
+				if pages_id != None:
+					vals = [0, pb.vaddr, pb.nr_pages, pb.in_parent]
+				else:
+					vals = [0, pb.pages_id]
+				pos = pe_end
+
+			if pages_id == None:
+				pages_id = vals[1]
+			else:
+				vaddr.append(vals[1])
+				nr_pages.append(vals[2])
+				in_parent.append(vals[3])
+
+		return pages_id, {'vaddr': vaddr, 'nr_pages': nr_pages,
+				'in_parent': in_parent}
+
+	def dump_columns(self, pages_id, columns, f):
+		"""
+		Reverse of load_columns. in_parent is only written for
+		entries that have it set, just like criu does.
+		"""
+		buf = bytearray()
+
+		pe = bytearray([0x08])
+		_encode_varint(pe, pages_id)
+		buf += struct.pack('i', len(pe))
+		buf += pe
+
+		in_parent = columns.get('in_parent')
+		for i, va in enumerate(columns['vaddr']):
+			pe = bytearray([0x08])
+			_encode_varint(pe, va)
+			pe.append(0x10)
+			_encode_varint(pe, columns['nr_pages'][i])
+			if in_parent and in_parent[i]:
+				pe += '\x18\x01'
+			buf += struct.pack('i', len(pe))
+			buf += pe
+
+		f.write(str(buf))
+
+def _decode_varint(buf, pos):
+	b = buf[pos]
+	if b < 0x80:
+		return b, pos + 1
+
+	val = b & 0x7f
+	shift = 7
+	while True:
+		pos += 1
+		b = buf[pos]
+		val |= (b & 0x7f) << shift
+		if b < 0x80:
+			return val, pos + 1
+		shift += 7
+
+def _encode_varint(buf, val):
+	while val >= 0x80:
+		buf.append((val & 0x7f) | 0x80)
+		val >>= 7
+	buf.append(val)
+
+def _skip_field(buf, pos, wire):
+	if wire == 0:
+		v, pos = _decode_varint(buf, pos)
+	elif wire == 1:
+		pos += 8
+	elif wire == 2:
+		l, pos = _decode_varint(buf, pos)
+		pos += l
+	elif wire == 5:
+		pos += 4
+	else:
+		raise Exception("Unsupported wire type %d" % wire)
+	return pos
+
+# Fields of vma_entry, that go into columns, by their numbers
+vma_columns = [None, ('start', index_fmt), ('end', index_fmt),
+		('pgoff', index_fmt), ('shmid', index_fmt), ('prot', 'I'),
+		('flags', 'I'), ('status', 'I')]
+
+def _vma_columns():
+	return [array.array(c[1]) if c else None for c in vma_columns]
+
+def _decode_vma(buf, pos, end, cols):
+	vals = [0] * len(vma_columns)
+	while pos < end:
+		key, pos = _decode_varint(buf, pos)
+		nr = key >> 3
+		if nr < len(vma_columns) and key & 7 == 0:
+			vals[nr], pos = _decode_varint(buf, pos)
+		else:
+			pos = _skip_field(buf, pos, key & 7)
+
+	for nr in xrange(1, len(vma_columns)):
+		cols[nr].append(vals[nr])
+
+def _decode_mm_vmas(buf, pos, end, cols):
+	while pos < end:
+		key, pos = _decode_varint(buf, pos)
+		if key == (14 << 3 | 2):
+			l, pos = _decode_varint(buf, pos)
+			_decode_vma(buf, pos, pos + l, cols)
+			pos += l
+		else:
+			pos = _skip_field(buf, pos, key & 7)
 
-# In following extra handlers we use base64 encoding
-# to store binary data. Even though, the nature
-# of base64 is that it increases the total size,
-# it doesn't really matter, because our images
-# do not store big amounts of binary data. They
-# are negligible comparing to pages size.
-class pipes_data_extra_handler:
-	def load(self, f, pload):
-		size = pload.bytes
-		data = f.read(size)
-		return data.encode('base64')
 
-	def dump(self, extra, f, pload):
-		data = extra.decode('base64')
+class raw_handler:
+	"""
+	Handler for images, that are not in criu format, but keep raw
+	data -- pages, iptables-save output, tmpfs tarballs, etc. Such
+	an image has no magic and has a single entry with the whole
+	file as its extra, so that blobs codecs can stream it.
+	"""
+	def iter_entries(self, f, pretty = False, start = 0, raw = False,
+			fields = None, skip_extra = False, blobs = None):
+		if start != 0:
+			return
+
+		if blobs is None:
+			if raw:
+				blobs = raw_blobs()
+			else:
+				blobs = base64_blobs()
+
+		pos = f.tell()
+		f.seek(0, 2)
+		if f.tell() == pos:
+			return
+		f.seek(pos)
+
+		if skip_extra:
+			f.seek(0, 2)
+			extra = None
+		else:
+			extra = blobs.load(f, None)
+
+		if raw:
+			yield (None, extra)
+		elif skip_extra:
+			yield {}
+		else:
+			yield {'extra': extra}
+
+	def load(self, f, pretty = False, raw = False, fields = None,
+			skip_extra = False, blobs = None):
+		return list(self.iter_entries(f, pretty, 0, raw, fields,
+					skip_extra, blobs))
+
+	def dump(self, entries, f, blobs = None):
+		for entry in entries:
+			if isinstance(entry, dict):
+				extra = entry.get('extra')
+				eblobs = blobs or base64_blobs()
+			else:
+				extra = entry[1]
+				eblobs = blobs or raw_blobs()
+
+			if extra:
+				eblobs.dump(extra, f)
+
+	def index(self, f):
+		idx = array.array(index_fmt)
+		pos = f.tell()
+		f.seek(0, 2)
+		if f.tell() != pos:
+			idx.extend((pos, 0, f.tell() - pos))
+		return idx
+
+	def count(self, f, nr = None):
+		if nr is None:
+			nr = len(self.index(f)) / 3
+		return nr
+
+# Extras carry arbitrary binary data, and it is up to a blob
+# codec how this data is represented in the loaded image. Codec's
+# load() reads size bytes (or everything up to the end of file if
+# size is None) and returns them in its representation, and dump()
+# writes at most size bytes of such a representation back.
+#
+# In dict(json) images we use base64 encoding to store binary
+# data. Even though, the nature of base64 is that it increases
+# the total size, it doesn't really matter, because our images
+# do not store big amounts of binary data. They are negligible
+# comparing to pages size.
+class base64_blobs:
+	def load(self, f, size):
+		if size is None:
+			size = -1
+		return base64.encodestring(f.read(size))
+
+	def dump(self, blob, f, size = None):
+		data = blob.decode('base64')
+		if size is not None:
+			data = data[:size]
 		f.write(data)
 
+# Raw images keep binary data as is, i.e. as strings, or
+# as buffers when the image is read through mmap_file.
+class raw_blobs:
+	def load(self, f, size):
+		if size is None:
+			size = -1
+		return f.read(size)
+
+	def dump(self, blob, f, size = None):
+		if size is not None:
+			blob = blob[:size]
+		f.write(blob)
+
+# Binary data of extras can also be kept in separate files in a
+# directory, and the image then refers to them with {'blob': name}
+# dicts. Data is copied to and from these files in chunks, so even
+# huge ghost files or SysV shmem segments never sit in memory.
+class dir_blobs:
+	chunk_size = 1 << 20
+
+	def __init__(self, path, prefix = 'extra'):
+		self.path	= path
+		self.prefix	= prefix
+		self.nr		= 0
+
+	def __copy(self, src, dst, size):
+		while size is None or size > 0:
+			if size is None:
+				chunk = self.chunk_size
+			else:
+				chunk = min(size, self.chunk_size)
+
+			data = src.read(chunk)
+			if not data:
+				break
+
+			dst.write(data)
+			if size is not None:
+				size -= len(data)
+
+	def load(self, f, size):
+		# Don't overwrite blobs of other images in the directory
+		while True:
+			name = '%s.%d.blob' % (self.prefix, self.nr)
+			self.nr += 1
+			if not os.path.exists(os.path.join(self.path, name)):
+				break
+
+		bf = open(os.path.join(self.path, name), 'wb')
+		self.__copy(f, bf, size)
+		bf.close()
+
+		return {'blob': name}
+
+	def dump(self, blob, f, size = None):
+		if not isinstance(blob, dict):
+			return base64_blobs().dump(blob, f, size)
+
+		bf = open(os.path.join(self.path, blob['blob']), 'rb')
+		self.__copy(bf, f, size)
+		bf.close()
+
+class pipes_data_extra_handler:
+	def load(self, f, pload, blobs, raw = False):
+		return blobs.load(f, pload.bytes)
+
+	def dump(self, extra, f, pload, blobs):
+		blobs.dump(extra, f)
+
+	def skip(self, f, pload):
+		f.seek(pload.bytes, 1)
+
 class sk_queues_extra_handler:
-	def load(self, f, pload):
-		size = pload.length
-		data = f.read(size)
-		return data.encode('base64')
+	def load(self, f, pload, blobs, raw = False):
+		return blobs.load(f, pload.length)
 
-	def dump(self, extra, f, pb):
-		data = extra.decode('base64')
-		f.write(data)
+	def dump(self, extra, f, pb, blobs):
+		blobs.dump(extra, f)
+
+	def skip(self, f, pload):
+		f.seek(pload.length, 1)
 
 class ghost_file_extra_handler:
-	def load(self, f, pb):
-		data = f.read()
-		return data.encode('base64')
+	def load(self, f, pb, blobs, raw = False):
+		return blobs.load(f, None)
 
-	def dump(self, extra, f, pb):
-		data = extra.decode('base64')
-		f.write(data)
+	def dump(self, extra, f, pb, blobs):
+		blobs.dump(extra, f)
+
+	def skip(self, f, pb):
+		f.seek(0, 2)
 
 class tcp_stream_extra_handler:
-	def load(self, f, pb):
+	def load(self, f, pb, blobs, raw = False):
 		d = {}
 
-		inq	= f.read(pb.inq_len)
-		outq	= f.read(pb.outq_len)
-
-		d['inq']	= inq.encode('base64')
-		d['outq']	= outq.encode('base64')
+		d['inq']	= blobs.load(f, pb.inq_len)
+		d['outq']	= blobs.load(f, pb.outq_len)
 
 		return d
 
-	def dump(self, extra, f, pb):
-		inq	= extra['inq'].decode('base64')
-		outq	= extra['outq'].decode('base64')
+	def dump(self, extra, f, pb, blobs):
+		blobs.dump(extra['inq'], f)
+		blobs.dump(extra['outq'], f)
 
-		f.write(inq)
-		f.write(outq)
+	def skip(self, f, pb):
+		f.seek(pb.inq_len + pb.outq_len, 1)
 
 class ipc_sem_set_handler:
-	def load(self, f, pb):
-		entry = pb2dict.pb2dict(pb)
-		size = sizeof_u16 * entry['nsems']
+	def load(self, f, pb, blobs, raw = False):
+		size = sizeof_u16 * pb.nsems
 		rounded = round_up(size, sizeof_u64)
 		s = array.array('H')
 		if s.itemsize != sizeof_u16:
@@ -273,68 +756,83 @@ class ipc_sem_set_handler:
 		f.seek(rounded - size, 1)
 		return s.tolist()
 
-	def dump(self, extra, f, pb):
-		entry = pb2dict.pb2dict(pb)
-		size = sizeof_u16 * entry['nsems']
+	def dump(self, extra, f, pb, blobs):
+		size = sizeof_u16 * pb.nsems
 		rounded = round_up(size, sizeof_u64)
 		s = array.array('H')
 		if s.itemsize != sizeof_u16:
 			raise Exception("Array size mismatch")
 		s.fromlist(extra)
-		if len(s) != entry['nsems']:
+		if len(s) != pb.nsems:
 			raise Exception("Number of semaphores mismatch")
 		f.write(s.tostring())
 		f.write('\0' * (rounded - size))
 
+	def skip(self, f, pb):
+		f.seek(round_up(sizeof_u16 * pb.nsems, sizeof_u64), 1)
+
 class ipc_msg_queue_handler:
-	def load(self, f, pb):
-		entry = pb2dict.pb2dict(pb)
+	def load(self, f, pb, blobs, raw = False):
 		messages = []
-		for x in range (0, entry['qnum']):
+		for x in range (0, pb.qnum):
 			buf = f.read(4)
-			if buf == '':
+			if not buf:
 				break
 			size, = struct.unpack('i', buf)
 			msg = ipc_msg()
 			msg.ParseFromString(f.read(size))
 			rounded = round_up(msg.msize, sizeof_u64)
-			data = f.read(msg.msize)
+			data = blobs.load(f, msg.msize)
 			f.seek(rounded - msg.msize, 1)
-			messages.append(pb2dict.pb2dict(msg))
-			messages.append(data.encode('base64'))
+			if raw:
+				messages.append(msg)
+			else:
+				messages.append(pb2dict.pb2dict(msg))
+			messages.append(data)
 		return messages
 
-	def dump(self, extra, f, pb):
-		entry = pb2dict.pb2dict(pb)
+	def dump(self, extra, f, pb, blobs):
 		for i in range (0, len(extra), 2):
-			msg = ipc_msg()
-			pb2dict.dict2pb(extra[i], msg)
+			if isinstance(extra[i], dict):
+				msg = ipc_msg()
+				pb2dict.dict2pb(extra[i], msg)
+			else:
+				msg = extra[i]
 			msg_str = msg.SerializeToString()
 			size = len(msg_str)
 			f.write(struct.pack('i', size))
 			f.write(msg_str)
 			rounded = round_up(msg.msize, sizeof_u64)
-			data = extra[i + 1].decode('base64')
-			f.write(data[:msg.msize])
+			blobs.dump(extra[i + 1], f, msg.msize)
 			f.write('\0' * (rounded - msg.msize))
 
+	def skip(self, f, pb):
+		for x in range (0, pb.qnum):
+			buf = f.read(4)
+			if not buf:
+				break
+			size, = struct.unpack('i', buf)
+			msg = ipc_msg()
+			msg.ParseFromString(f.read(size))
+			f.seek(round_up(msg.msize, sizeof_u64), 1)
+
 class ipc_shm_handler:
-	def load(self, f, pb):
-		entry = pb2dict.pb2dict(pb)
-		size = entry['size']
-		data = f.read(size)
+	def load(self, f, pb, blobs, raw = False):
+		size = pb.size
+		data = blobs.load(f, size)
 		rounded = round_up(size, sizeof_u32)
 		f.seek(rounded - size, 1)
-		return data.encode('base64')
+		return data
 
-	def dump(self, extra, f, pb):
-		entry = pb2dict.pb2dict(pb)
-		size = entry['size']
-		data = extra.decode('base64')
+	def dump(self, extra, f, pb, blobs):
+		size = pb.size
 		rounded = round_up(size, sizeof_u32)
-		f.write(data[:size])
+		blobs.dump(extra, f, size)
 		f.write('\0' * (rounded - size))
 
+	def skip(self, f, pb):
+		f.seek(round_up(pb.size, sizeof_u32), 1)
+
 handlers = {
 	'INVENTORY'		: entry_handler(inventory_entry),
 	'CORE'			: entry_handler(core_entry),
@@ -391,9 +889,71 @@ handlers = {
 	'NETNS'			: entry_handler(netns_entry),
 	'USERNS'		: entry_handler(userns_entry),
 	'SECCOMP'		: entry_handler(seccomp_entry),
+	'CPUINFO'		: entry_handler(cpuinfo_entry),
+	'SIGNAL'		: entry_handler(signal_queue_entry),
+	'BINFMT_MISC'		: entry_handler(binfmt_misc_entry),
+
+	'PAGES'			: raw_handler(),
+	'IFADDR'		: raw_handler(),
+	'ROUTE'			: raw_handler(),
+	'ROUTE6'		: raw_handler(),
+	'RULE'			: raw_handler(),
+	'IPTABLES'		: raw_handler(),
+	'IP6TABLES'		: raw_handler(),
+	'TMPFS_IMG'		: raw_handler(),
+	'TMPFS_DEV'		: raw_handler(),
 	}
 
+# Some images share magic with others and are decoded as those
+magic_aliases = {
+	'SHMEM_PAGEMAP'		: 'PAGEMAP',
+	'PSIGNAL'		: 'SIGNAL',
+}
+
+handlers['SHMEM_PAGEMAP'] = handlers['PAGEMAP']
+handlers['PSIGNAL'] = handlers['SIGNAL']
+
+# Raw images have no magic, so they are told by their file names
+raw_images = [
+	('PAGES',	re.compile(r'pages-\d+\.img$')),
+	('IFADDR',	re.compile(r'ifaddr-\d+\.img$')),
+	('ROUTE',	re.compile(r'route-\d+\.img$')),
+	('ROUTE6',	re.compile(r'route6-\d+\.img$')),
+	('RULE',	re.compile(r'rule-\d+\.img$')),
+	('IPTABLES',	re.compile(r'iptables-\d+\.img$')),
+	('IP6TABLES',	re.compile(r'ip6tables-\d+\.img$')),
+	('TMPFS_IMG',	re.compile(r'tmpfs-\d+\.tar\.gz\.img$')),
+	('TMPFS_DEV',	re.compile(r'tmpfs-dev-\d+\.tar\.gz\.img$')),
+]
+
+def __raw_magic(f):
+	name = getattr(f, 'name', None)
+	if not isinstance(name, basestring):
+		return None
+
+	name = os.path.basename(name)
+	for m, rx in raw_images:
+		if rx.match(name):
+			break
+	else:
+		return None
+
+	# Old pages images (pages-<pid>.img) were not raw, they
+	# started with magic. Neither can raw data start with it.
+	pos = f.tell()
+	buf = f.read(4)
+	f.seek(pos)
+	if len(buf) == 4 and struct.unpack('i', buf)[0] in \
+			(magic.by_name['IMG_COMMON'], magic.by_name['IMG_SERVICE']):
+		return None
+
+	return m
+
 def __rhandler(f):
+	m = __raw_magic(f)
+	if m:
+		return m, handlers[m]
+
 	# Images v1.1 NOTE: First read "first" magic.
 	img_magic, = struct.unpack('i', f.read(4))
 	if img_magic in (magic.by_name['IMG_COMMON'], magic.by_name['IMG_SERVICE']):
@@ -411,69 +971,640 @@ def __rhandler(f):
 
 	return m, handler
 
-def load(f, pretty = False):
+def get_magic(f):
 	"""
-	Convert criu image from binary format to dict(json).
-	Takes a file-like object to read criu image from.
-	Returns criu image in dict(json) format.
+	Returns the name of the magic of the image f is positioned
+	at. Raw images (pages, iptables, etc.) have no magic, they
+	are told by file names (see raw_images) and get the names
+	like PAGES or IPTABLES, with f left at the image start. Other
+	images without known magic raise MagicException.
+	"""
+	try:
+		m, handler = __rhandler(f)
+	except struct.error:
+		# Too short to be a criu image
+		raise MagicException(0)
+
+	return m
+
+def iter_load(f, pretty = False, raw = False, fields = None, skip_extra = False,
+		blobs = None):
+	"""
+	Same as load(), but the 'entries' of the returned image is
+	a generator, that decodes entries one by one while it is
+	being iterated. The file must stay open until then.
 	"""
+	cache = None
+	# Messages and extras put aside by blobs are not cached, neither
+	# are raw images, as these are the bulk data (pages, tarballs)
+	if not raw and not blobs and not __raw_magic(f):
+		cache = __cache_path(f, (bool(pretty), fields and tuple(fields),
+					bool(skip_extra)))
+	if cache:
+		image = __cache_load(cache)
+		if image:
+			image['entries'] = itertools.imap(__cache_dict,
+						image['entries'])
+			return image
+
 	image = {}
 
 	m, handler = __rhandler(f)
 
 	image['magic'] = m
-	image['entries'] = handler.load(f, pretty)
+	image['entries'] = handler.iter_entries(f, pretty, 0, raw, fields,
+					skip_extra, blobs)
+	if cache:
+		image['entries'] = __cache_entries(cache, m, image['entries'])
+
+	return image
+
+#
+# Decoded images can be cached on disk. The cache is off unless
+# PYCRIU_CACHE_DIR environment variable names the directory for it.
+# Each decoded image is pickled into a file, that is named after the
+# image path, size, mtime and a hash of its head and tail, as well as
+# the decode options. Least recently used files are removed once the
+# cache grows above PYCRIU_CACHE_SIZE bytes. Only the cache files,
+# that belong to the user and can't be written by others, are loaded.
+#
+# Order of keys of a plain dict depends on the order they were put
+# into it, so non-pretty entries are stored as tuples of (key, value)
+# pairs in the order, that rebuilds a dict with the keys in the same
+# order as decoded ones have -- the order of field numbers, as both
+# pb2dict and the wire decoder put fields in that order.
+#
+# Modules the cache needs are imported only when it is on.
+#
+cache_size_default = 1 << 30
+cache_hash_chunk = 1 << 16
+
+def __cache_hash(name, size):
+	import zlib
+	hf = open(name, 'rb')
+	h = zlib.crc32(hf.read(cache_hash_chunk))
+	if size > cache_hash_chunk:
+		hf.seek(max(cache_hash_chunk, size - cache_hash_chunk))
+		h = zlib.crc32(hf.read(), h)
+	hf.close()
+	return h
+
+def __cache_path(f, opts):
+	cdir = os.environ.get('PYCRIU_CACHE_DIR')
+	name = getattr(f, 'name', None)
+	if not cdir or not isinstance(name, str):
+		return None
+
+	try:
+		if f.tell() != 0:
+			return None
+		st = os.stat(name)
+		h = __cache_hash(name, st.st_size)
+	except (IOError, OSError):
+		return None
+
+	import hashlib
+	key = (os.path.abspath(name), st.st_size, st.st_mtime, h, opts)
+	return os.path.join(cdir, hashlib.sha1(repr(key)).hexdigest())
+
+def __cache_trusted(st):
+	return st.st_uid == os.getuid() and \
+		not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+def __cache_load(path):
+	import cPickle
+	try:
+		# Unpickling runs code, so cache of other users is not used
+		if not __cache_trusted(os.stat(os.path.dirname(path))):
+			return None
+		cf = open(path, 'rb')
+		if not __cache_trusted(os.fstat(cf.fileno())):
+			cf.close()
+			return None
+		image = cPickle.load(cf)
+		cf.close()
+		# Mark as recently used for eviction
+		os.utime(path, None)
+	except Exception:
+		return None
+
+	return image
+
+def __cache_store(path, image):
+	import cPickle
+	cdir = os.path.dirname(path)
+	try:
+		if not os.path.isdir(cdir):
+			os.makedirs(cdir, 0700)
+		cf = open(path + '.tmp', 'wb')
+		cPickle.dump(image, cf, cPickle.HIGHEST_PROTOCOL)
+		cf.close()
+		os.rename(path + '.tmp', path)
+		__cache_evict(cdir)
+	except (IOError, OSError, cPickle.PicklingError):
+		pass
+
+def __cache_evict(cdir):
+	limit = int(os.environ.get('PYCRIU_CACHE_SIZE', cache_size_default))
+
+	files = []
+	total = 0
+	for name in os.listdir(cdir):
+		path = os.path.join(cdir, name)
+		try:
+			st = os.stat(path)
+		except OSError:
+			continue
+		files.append((st.st_mtime, st.st_size, path))
+		total += st.st_size
+
+	files.sort()
+	for mtime, size, path in files:
+		if total <= limit:
+			break
+		try:
+			os.unlink(path)
+		except OSError:
+			continue
+		total -= size
+
+__cache_orders = {}
+
+def __cache_order(keys, desc):
+	"""
+	Returns the order to put the keys into a dict in, so that
+	they come out of it in the given order. Fields go first by
+	numbers, the rest of keys (e.g. 'extra') after them.
+	"""
+	key = (keys, desc)
+	order = __cache_orders.get(key)
+	if order:
+		return order
+
+	by_name = desc and desc.fields_by_name or {}
+	nums = [by_name[k].number if k in by_name else 1 << 30 for k in keys]
+	order = [k for n, k in sorted(zip(nums, keys), key = lambda x: x[0])]
+	cands = [order, keys]
+	if len(keys) <= 6:
+		cands = itertools.chain(cands, itertools.permutations(keys))
+
+	for c in cands:
+		if tuple(dict.fromkeys(c).keys()) == keys:
+			order = tuple(c)
+			break
+
+	__cache_orders[key] = order
+	return order
+
+def __cache_pairs(v, desc):
+	if type(v) is list:
+		return [__cache_pairs(x, desc) for x in v]
+	if type(v) is not dict:
+		return v
+
+	by_name = desc and desc.fields_by_name or {}
+	pairs = []
+	for k in __cache_order(tuple(v.keys()), desc):
+		field = by_name.get(k)
+		pairs.append((k, __cache_pairs(v[k], field and field.message_type)))
+	return tuple(pairs)
+
+def __cache_dict(v):
+	t = type(v)
+	if t is tuple:
+		return dict([(k, __cache_dict(x)) for k, x in v])
+	if t is list:
+		return [__cache_dict(x) for x in v]
+	return v
+
+def __cache_entries(path, m, entries):
+	handler = handlers[m]
+	if isinstance(handler, pagemap_handler):
+		descs = itertools.chain([pagemap_head.DESCRIPTOR],
+				itertools.repeat(pagemap_entry.DESCRIPTOR))
+	else:
+		descs = itertools.repeat(handler.payload.DESCRIPTOR)
+
+	# Image is cached once all its entries are decoded
+	cached = []
+	for e, desc in itertools.izip(entries, descs):
+		cached.append(__cache_pairs(e, desc))
+		yield e
+
+	__cache_store(path, {'magic': m, 'entries': cached})
+
+def load(f, pretty = False, raw = False, fields = None, skip_extra = False,
+		blobs = None):
+	"""
+	Convert criu image from binary format to dict(json).
+	Takes a file-like object to read criu image from.
+	Returns criu image in dict(json) format.
+
+	With raw set, entries are kept as protobuf messages and
+	no dict(json) conversion is done. If the image has extras,
+	each entry is a (message, extra) tuple, with binary data of
+	the extra kept as is.
+
+	Fields is a list of (dot-separated for nested messages)
+	names of fields to be converted, the rest are dropped. With
+	skip_extra set, extras are not read. Blobs is the codec for
+	binary data in extras, e.g. dir_blobs to put it into files.
+	"""
+	image = iter_load(f, pretty, raw, fields, skip_extra, blobs)
+	image['entries'] = list(image['entries'])
 
 	return image
 
+def __seekable(f):
+	try:
+		f.tell()
+	except IOError:
+		return False
+	return True
+
 def info(f):
 	res = {}
 
+	# Entries are counted by seeking over them, so pipes
+	# are read into memory first
+	if not __seekable(f):
+		f = io.BytesIO(f.read())
+
 	m, handler = __rhandler(f)
 
 	res['magic'] = m
-	res['count'] = handler.count(f)
+	res['count'] = handler.count(f, __read_index(f, count_only = True))
 
 	return res
 
-def loads(s, pretty = False):
+#
+# Entries index is built in one pass over the image and is saved
+# next to it in a sidecar file with .idx suffix, i.e. index() and
+# friends write into the images directory, unless it's read-only.
+# With PYCRIU_CACHE_DIR set sidecars go to the cache directory
+# instead and are evicted along with decoded images. The sidecar
+# holds the size and mtime of the image it was built for and the
+# number of entries, and is ignored once they don't match.
+#
+index_magic = 0x58444943
+index_hdr = '=IIQdQ'
+
+def __index_stat(f):
+	name = getattr(f, 'name', None)
+	if not isinstance(name, str):
+		return None, None
+
+	try:
+		st = os.stat(name)
+	except OSError:
+		return None, None
+
+	cdir = os.environ.get('PYCRIU_CACHE_DIR')
+	if cdir:
+		import hashlib
+		key = hashlib.sha1(os.path.abspath(name)).hexdigest()
+		return os.path.join(cdir, key + '.idx'), st
+
+	return name + '.idx', st
+
+def __read_index(f, count_only = False):
+	"""
+	Returns the index from the sidecar, or just the number of
+	entries in it with count_only set, which only needs the
+	sidecar header to be read.
+	"""
+	path, st = __index_stat(f)
+	if not path:
+		return None
+
+	try:
+		idxf = open(path, 'rb')
+	except IOError:
+		return None
+
+	try:
+		hdr_size = struct.calcsize(index_hdr)
+		hdr = idxf.read(hdr_size)
+		if len(hdr) != hdr_size:
+			return None
+
+		magic_val, itemsize, size, mtime, count = struct.unpack(index_hdr, hdr)
+		idx = array.array(index_fmt)
+		if magic_val != index_magic or itemsize != idx.itemsize or \
+				size != st.st_size or mtime != st.st_mtime:
+			return None
+
+		if count_only:
+			# Sidecars are renamed into place when complete,
+			# but the size check is cheap
+			if os.fstat(idxf.fileno()).st_size != \
+					hdr_size + 3 * count * itemsize:
+				return None
+			return count
+
+		try:
+			idx.fromfile(idxf, 3 * count)
+		except EOFError:
+			return None
+
+		return idx
+	finally:
+		idxf.close()
+
+def __write_index(f, idx):
+	path, st = __index_stat(f)
+	if not path:
+		return
+
+	# Index is just a cache, so it's fine not to have
+	# one e.g. in a read-only images directory.
+	try:
+		idir = os.path.dirname(path)
+		if idir and not os.path.isdir(idir):
+			os.makedirs(idir, 0700)
+		idxf = open(path + '.tmp', 'wb')
+		idxf.write(struct.pack(index_hdr, index_magic, idx.itemsize,
+				st.st_size, st.st_mtime, len(idx) / 3))
+		idx.tofile(idxf)
+		idxf.close()
+		os.rename(path + '.tmp', path)
+	except (IOError, OSError):
+		pass
+
+def __load_index(f):
+	m, handler = __rhandler(f)
+
+	idx = __read_index(f)
+	if idx is None:
+		idx = handler.index(f)
+		__write_index(f, idx)
+
+	return m, handler, idx
+
+def index(f):
+	"""
+	Returns a list of (offset, size, extra_size) tuples, one
+	for each entry in the image. The index is built in a single
+	pass over the image and is saved in a sidecar file (next to
+	the image or in PYCRIU_CACHE_DIR), so next time it is read
+	from there.
+	"""
+	m, handler, idx = __load_index(f)
+
+	return zip(idx[0::3], idx[1::3], idx[2::3])
+
+def get_entry(f, n, pretty = False, raw = False):
+	"""
+	Returns the n-th entry of the image in dict(json) format
+	without decoding the entries before it.
+	"""
+	m, handler, idx = __load_index(f)
+
+	nr = len(idx) / 3
+	if n < 0:
+		n += nr
+	if n < 0 or n >= nr:
+		raise IndexError("Image has %d entries" % nr)
+
+	f.seek(idx[3 * n])
+	return next(handler.iter_entries(f, pretty, n, raw))
+
+def slice(f, start, stop, pretty = False, raw = False):
+	"""
+	Returns a list with entries from start up to (but not
+	including) stop in dict(json) format, just like list slicing
+	does, but without decoding the entries out of this range.
+	"""
+	m, handler, idx = __load_index(f)
+
+	nr = len(idx) / 3
+	start, stop = __slice_bounds(start, stop, nr)
+	if start >= stop:
+		return []
+
+	f.seek(idx[3 * start])
+	return list(itertools.islice(handler.iter_entries(f, pretty, start, raw),
+				stop - start))
+
+def __slice_bounds(start, stop, nr):
+	bounds = []
+	for x in (start, stop):
+		if x is None:
+			x = nr if bounds else 0
+		elif x < 0:
+			x += nr
+		bounds.append(min(max(x, 0), nr))
+
+	return bounds
+
+#
+# Decoding of selected fields right from the protobuf wire format.
+# For every message DESCRIPTOR and list of fields a plan is built --
+# a map of field numbers to (field, converter, sub-plan) -- so that
+# fields that are not asked for are skipped without being parsed.
+# Values are converted the way pb2dict does it in non-pretty mode.
+#
+_wire_plans = {}
+
+def _wire_cast(field, tree):
+	if field.type == FD.TYPE_MESSAGE:
+		if tree is None:
+			return lambda raw: _wire_decode(raw, _wire_plan(field.message_type))
+
+		plan = _wire_subplan(field.message_type, tree)
+		return lambda raw: _wire_decode(raw, plan)
+
+	cast = pb2dict._pb2dict_cast(field)
+	if field.type in (FD.TYPE_INT32, FD.TYPE_INT64):
+		return lambda v: cast(v - (1 << 64) if v >> 63 else v)
+	elif field.type in (FD.TYPE_SINT32, FD.TYPE_SINT64):
+		return lambda v: cast((v >> 1) ^ -(v & 1))
+	elif field.type == FD.TYPE_SFIXED32:
+		return lambda v: cast(v - (1 << 32) if v >> 31 else v)
+	elif field.type == FD.TYPE_SFIXED64:
+		return lambda v: cast(v - (1 << 64) if v >> 63 else v)
+	elif field.type == FD.TYPE_STRING:
+		return lambda raw: raw.decode('utf-8')
+	elif field.type == FD.TYPE_BYTES:
+		return lambda raw: cast(str(raw))
+
+	return cast
+
+def _wire_subplan(descriptor, tree):
+	plan = {}
+	for field in descriptor.fields:
+		if tree is None or field.name in tree:
+			sub = tree and tree[field.name]
+			plan[field.number] = (field, _wire_cast(field, sub))
+
+	return plan
+
+def _wire_plan(descriptor, fields = None):
+	key = (descriptor, fields and tuple(fields))
+	plan = _wire_plans.get(key)
+	if plan is None:
+		tree = fields and pb2dict._projection(fields)
+		plan = _wire_subplan(descriptor, tree)
+		_wire_plans[key] = plan
+
+	return plan
+
+def _wire_value(buf, pos, wire):
+	if wire == 0:
+		return _decode_varint(buf, pos)
+	elif wire == 1:
+		return struct.unpack_from('<Q', buf, pos)[0], pos + 8
+	elif wire == 5:
+		return struct.unpack_from('<I', buf, pos)[0], pos + 4
+	elif wire == 2:
+		l, pos = _decode_varint(buf, pos)
+		return buf[pos:pos + l], pos + l
+	else:
+		raise Exception("Unsupported wire type %d" % wire)
+
+def _wire_decode(buf, plan, pos = 0, end = None):
+	if end is None:
+		end = len(buf)
+
+	d = {}
+	while pos < end:
+		key, pos = _decode_varint(buf, pos)
+		fp = plan.get(key >> 3)
+		if not fp:
+			pos = _skip_field(buf, pos, key & 7)
+			continue
+
+		field, cast = fp
+		v, pos = _wire_value(buf, pos, key & 7)
+		if field.label != FD.LABEL_REPEATED:
+			d[field.name] = cast(v)
+		elif key & 7 == 2 and field.type not in (FD.TYPE_STRING,
+				FD.TYPE_BYTES, FD.TYPE_MESSAGE):
+			# Packed repeated scalars
+			vals = d.setdefault(field.name, [])
+			ppos = 0
+			wire = 0
+			if field.type in (FD.TYPE_FIXED64, FD.TYPE_SFIXED64):
+				wire = 1
+			elif field.type in (FD.TYPE_FIXED32, FD.TYPE_SFIXED32):
+				wire = 5
+			while ppos < len(v):
+				pv, ppos = _wire_value(v, ppos, wire)
+				vals.append(cast(pv))
+		else:
+			d.setdefault(field.name, []).append(cast(v))
+
+	return d
+
+def iter_fields(f, fields):
+	"""
+	Yields entries of the image with only the given fields and
+	without extras. For images without extras the fields are
+	decoded right from the wire, skipping the rest of the payload.
+	"""
+	return iter_load(f, fields = fields, skip_extra = True)['entries']
+
+def __columns(f):
+	m = get_magic(f)
+
+	if m == 'PAGEMAP':
+		pages_id, cols = pagemap_handler().load_columns(f)
+		return cols
+
+	if m not in ('MM', 'VMAS'):
+		raise Exception("No columns for %s image" % m)
+
+	vcols = _vma_columns()
+	buf = bytearray(f.read())
+	pos = 0
+	while pos < len(buf):
+		size, = struct.unpack_from('i', buf, pos)
+		pos += 4
+		if m == 'MM':
+			_decode_mm_vmas(buf, pos, pos + size, vcols)
+		else:
+			_decode_vma(buf, pos, pos + size, vcols)
+		pos += size
+
+	cols = {}
+	for i, c in enumerate(vma_columns):
+		if c:
+			cols[c[0]] = vcols[i]
+
+	return cols
+
+def columns(f):
+	"""
+	Returns a dict of column arrays for images, that are mostly
+	long runs of numbers -- VMAs of mm (or vmas) image with start,
+	end, pgoff, prot, flags, status and shmid columns, and pagemap
+	one with vaddr, nr_pages and in_parent. Columns are numpy
+	arrays if numpy is available and array.array-s otherwise.
+	Entries are decoded from raw varints without pb2dict.
+	"""
+	cache = __cache_path(f, 'columns')
+	cols = cache and __cache_load(cache)
+	if not cols:
+		cols = __columns(f)
+		if cache:
+			__cache_store(cache, cols)
+
+	# Numpy is heavy to import, so it's only done here
+	try:
+		import numpy
+	except ImportError:
+		numpy = None
+
+	if numpy:
+		for name, col in cols.items():
+			cols[name] = numpy.frombuffer(col, numpy.dtype(col.typecode))
+
+	return cols
+
+def loads(s, pretty = False, raw = False, fields = None, skip_extra = False,
+		blobs = None):
 	"""
 	Same as load(), but takes a string.
 	"""
 	f = io.BytesIO(s)
-	return load(f, pretty)
+	return load(f, pretty, raw, fields, skip_extra, blobs)
 
-def dump(img, f):
+def dump(img, f, blobs = None):
 	"""
 	Convert criu image from dict(json) format to binary.
 	Takes an image in dict(json) format and file-like
-	object to write to.
+	object to write to. Image entries may also be protobuf
+	messages, as returned by load() in raw mode. Blobs is the
+	codec the image extras were loaded with.
 	"""
 	m = img['magic']
-	magic_val = magic.by_name[img['magic']]
-
-	# Images v1.1 NOTE: use "second" magic to identify what "first"
-	# should be written.
-	if m != 'INVENTORY':
-		if m in ('STATS', 'IRMAP_CACHE'):
-			f.write(struct.pack('i', magic.by_name['IMG_SERVICE']))
-		else:
-			f.write(struct.pack('i', magic.by_name['IMG_COMMON']))
-
-	f.write(struct.pack('i', magic_val))
 
 	try:
 		handler = handlers[m]
 	except:
 		raise Exception("No handler found for image with such magic")
 
-	handler.dump(img['entries'], f)
+	# Raw images have no magic at all
+	if not isinstance(handler, raw_handler):
+		magic_val = magic.by_name[magic_aliases.get(m, m)]
+
+		# Images v1.1 NOTE: use "second" magic to identify what "first"
+		# should be written.
+		if m != 'INVENTORY':
+			if m in ('STATS', 'IRMAP_CACHE'):
+				f.write(struct.pack('i', magic.by_name['IMG_SERVICE']))
+			else:
+				f.write(struct.pack('i', magic.by_name['IMG_COMMON']))
+
+		f.write(struct.pack('i', magic_val))
+
+	handler.dump(img['entries'], f, blobs)
 
-def dumps(img):
+def dumps(img, blobs = None):
 	"""
 	Same as dump(), but takes only an image and returns
 	a string.
 	"""
 	f = io.BytesIO('')
-	dump(img, f)
+	dump(img, f, blobs)
 	return f.getvalue()
@@ -0,0 +1,205 @@
+# This file contains ImageDir -- a way to access images of a dump
+# directory by what they describe (pstree, task core, task mm, etc.)
+# rather than by file names. Images are decoded on first access and
+# kept in a bounded LRU cache, so that walking even very big dump
+# directories doesn't eat up all the memory.
+import os
+import collections
+
+import images
+import pages
+
+# Images with files, that fdinfo_entry-s of each type refer to by id
+file_images = {
+	'REG':		'reg-files.img',
+	'PIPE':		'pipes.img',
+	'FIFO':		'fifo.img',
+	'INETSK':	'inetsk.img',
+	'UNIXSK':	'unixsk.img',
+	'EVENTFD':	'eventfd.img',
+	'EVENTPOLL':	'eventpoll.img',
+	'INOTIFY':	'inotify.img',
+	'SIGNALFD':	'signalfd.img',
+	'PACKETSK':	'packetsk.img',
+	'TTY':		'tty.img',
+	'FANOTIFY':	'fanotify.img',
+	'NETLINKSK':	'netlinksk.img',
+	'NS':		'ns-files.img',
+	'TUNF':		'tunfile.img',
+	'EXT':		'ext-files.img',
+	'TIMERFD':	'timerfd.img',
+}
+
+class ImageDir:
+	"""
+	Images directory. Accessors return decoded entries of the
+	respective image -- a list of them for images with many
+	entries and a single entry for per-task ones (core, mm,
+	ids, fs). The last cache_size decoded images are cached.
+
+	With revalidate set, images are stat-ed on every access and
+	decoded again if their mtime or size has changed, which is
+	what long living users of ImageDir want.
+	"""
+	def __init__(self, path, cache_size = 64, revalidate = False):
+		self.path = path
+		self.cache_size = cache_size
+		self.revalidate = revalidate
+		self.__cache = collections.OrderedDict()
+
+	def exists(self, name):
+		return os.path.exists(os.path.join(self.path, name))
+
+	def __stamp(self, name):
+		if not self.revalidate:
+			return None
+
+		try:
+			st = os.stat(os.path.join(self.path, name))
+		except OSError:
+			return None
+
+		return (st.st_mtime, st.st_size)
+
+	def __forget(self, item):
+		# Task pages hold the pages image mapping
+		if isinstance(item[1], pages.task_pages):
+			item[1].close()
+
+	def __cached(self, key, get, name):
+		stamp = self.__stamp(name)
+		item = self.__cache.pop(key, None)
+		if item is not None and item[0] != stamp:
+			self.__forget(item)
+			item = None
+		if item is None:
+			item = (stamp, get())
+
+		self.__cache[key] = item
+		while len(self.__cache) > self.cache_size:
+			self.__forget(self.__cache.popitem(last = False)[1])
+
+		return item[1]
+
+	def load(self, name, pretty = False, raw = False, fields = None):
+		"""
+		Returns the image file name decoded with images.load().
+		"""
+		def get():
+			f = open(os.path.join(self.path, name), 'rb')
+			# Raw extras would be buffers into the mapping, that
+			# is gone once the image is loaded, so raw images are
+			# read from the file
+			if not raw:
+				f = images.mmap_file(f)
+			try:
+				return images.load(f, pretty, raw, fields)
+			finally:
+				f.close()
+
+		key = (name, pretty, raw, fields and tuple(fields))
+		return self.__cached(key, get, name)
+
+	def columns(self, name):
+		"""
+		Returns the image file name decoded with images.columns().
+		"""
+		def get():
+			f = open(os.path.join(self.path, name), 'rb')
+			try:
+				return images.columns(f)
+			finally:
+				f.close()
+
+		return self.__cached((name, 'columns'), get, name)
+
+	def entries(self, name, raw = False, fields = None):
+		return self.load(name, raw = raw, fields = fields)['entries']
+
+	def entry(self, name, raw = False, fields = None):
+		return self.entries(name, raw, fields)[0]
+
+	def drop(self):
+		"""
+		Forgets all the decoded images.
+		"""
+		for item in self.__cache.itervalues():
+			self.__forget(item)
+		self.__cache.clear()
+
+	def by_id(self, name):
+		"""
+		Returns a dict of entries of image name by their ids. It
+		is cached (and evicted) as decoded images are. A missing
+		image has no entries.
+		"""
+		def get():
+			idx = {}
+			if self.exists(name):
+				for e in self.entries(name):
+					idx[e['id']] = e
+			return idx
+
+		return self.__cached((name, 'by_id'), get, name)
+
+	def file(self, ftype, fid):
+		"""
+		Returns the entry of the file fdinfo_entry with type
+		ftype and id fid refers to, or None if there's no such.
+		"""
+		name = file_images.get(ftype)
+		if not name:
+			return None
+
+		return self.by_id(name).get(fid)
+
+	def inventory(self, raw = False):
+		return self.entry('inventory.img', raw)
+
+	def pstree(self, raw = False):
+		return self.entries('pstree.img', raw)
+
+	def core(self, pid, raw = False, fields = None):
+		return self.entry('core-%d.img' % pid, raw, fields)
+
+	def ids(self, pid, raw = False, fields = None):
+		return self.entry('ids-%d.img' % pid, raw, fields)
+
+	def mm(self, pid, raw = False, fields = None):
+		return self.entry('mm-%d.img' % pid, raw, fields)
+
+	def fs(self, pid, raw = False, fields = None):
+		return self.entry('fs-%d.img' % pid, raw, fields)
+
+	def pagemap(self, pid, raw = False):
+		return self.entries('pagemap-%d.img' % pid, raw)
+
+	def pages(self, pid):
+		"""
+		Returns pages.task_pages with memory contents of pid.
+		It is closed once evicted from the cache or dropped.
+		"""
+		return self.__cached(('pages', pid),
+				lambda: pages.open(self.path, pid),
+				'pagemap-%d.img' % pid)
+
+	def fdinfo(self, files_id, raw = False):
+		return self.entries('fdinfo-%d.img' % files_id, raw)
+
+	def reg_files(self, raw = False):
+		return self.entries('reg-files.img', raw)
+
+	def pipes(self, raw = False):
+		return self.entries('pipes.img', raw)
+
+	def fifo(self, raw = False):
+		return self.entries('fifo.img', raw)
+
+	def unixsk(self, raw = False):
+		return self.entries('unixsk.img', raw)
+
+	def inetsk(self, raw = False):
+		return self.entries('inetsk.img', raw)
+
+	def mountpoints(self, mnt_id, raw = False):
+		return self.entries('mountpoints-%d.img' % mnt_id, raw)
@@ -0,0 +1,49 @@
+# Importing all the _pb2 modules takes a good part of the time
+# crit needs to decode a single image. So pb.py doesn't import
+# them, but has a lazy_pb for every message instead, and each
+# _pb2 module is imported when its message is used first time.
+
+class lazy_pb(object):
+	"""
+	Stands for the message class name from the module _pb2
+	module. Calling it creates a message, and getting attributes
+	(e.g. DESCRIPTOR) returns those of the message class. It is
+	equal to the message class and isinstance() and issubclass()
+	checks against it are done with the message class too.
+	"""
+	def __init__(self, module, name):
+		self.module	= module
+		self.name	= name
+		self.__cls	= None
+
+	def resolve(self):
+		if not self.__cls:
+			mod = __import__(self.module, globals())
+			self.__cls = getattr(mod, self.name)
+		return self.__cls
+
+	def __call__(self, *args, **kwargs):
+		return self.resolve()(*args, **kwargs)
+
+	def __getattr__(self, name):
+		return getattr(self.resolve(), name)
+
+	def __repr__(self):
+		return '<lazy_pb %s.%s>' % (self.module, self.name)
+
+	def __eq__(self, other):
+		if isinstance(other, lazy_pb):
+			other = other.resolve()
+		return self.resolve() is other
+
+	def __ne__(self, other):
+		return not self == other
+
+	def __hash__(self):
+		return hash(self.resolve())
+
+	def __instancecheck__(self, obj):
+		return isinstance(obj, self.resolve())
+
+	def __subclasscheck__(self, cls):
+		return issubclass(cls, self.resolve())
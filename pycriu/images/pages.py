@@ -0,0 +1,119 @@
+# This file contains methods to read memory contents of a dumped
+# task. Pages are kept in pages-<id>.img raw image, and
+# pagemap-<pid>.img describes them. It starts with pagemap_head,
+# that tells the pages image id, followed by pagemap_entry-s, each
+# being a run of nr_pages pages starting at vaddr. Pages of entries
+# go one after another in the pages image, except for those marked
+# in_parent -- such pages are not in this image at all, but in the
+# images in the "parent" directory (see --prev-images-dir).
+import io
+import os
+import mmap
+import array
+import bisect
+
+import images
+
+PAGE_SIZE = mmap.PAGESIZE
+
+class PagesException(Exception):
+	def __init__(self, vaddr):
+		Exception.__init__(self, "Page at 0x%x is not dumped" % vaddr)
+		self.vaddr = vaddr
+
+class task_pages:
+	"""
+	Memory contents of a dumped task. Pagemap is turned into
+	sorted arrays of entries' start and end addresses and the
+	prefix sums of their sizes, i.e. offsets of their pages in
+	the pages image, so that any address is found with bisect.
+	The pages image itself is mmap-ed.
+	"""
+	def __init__(self, path, pid):
+		self.path	= path
+		self.pid	= pid
+		self.__parent	= None
+
+		pmf = io.open(os.path.join(path, 'pagemap-%d.img' % pid), 'rb')
+		images.get_magic(pmf)
+		pages_id, pm = images.pagemap_handler().load_columns(pmf)
+		pmf.close()
+
+		self.starts	= pm['vaddr']
+		self.ends	= array.array(images.index_fmt)
+		self.offsets	= array.array(images.index_fmt)
+		self.in_parent	= pm['in_parent']
+
+		off = 0
+		for i, nr in enumerate(pm['nr_pages']):
+			self.ends.append(self.starts[i] + nr * PAGE_SIZE)
+			self.offsets.append(off)
+			if not self.in_parent[i]:
+				off += nr * PAGE_SIZE
+
+		pf = io.open(os.path.join(path, 'pages-%d.img' % pages_id), 'rb')
+		if off:
+			self.pages = mmap.mmap(pf.fileno(), 0, access = mmap.ACCESS_READ)
+		else:
+			# Empty files can't be mmap-ed
+			self.pages = ''
+		pf.close()
+
+	def parent(self):
+		"""
+		Returns the pages of the same task in the parent
+		images directory, or None if there's no parent.
+		"""
+		if not self.__parent:
+			ppath = os.path.join(self.path, 'parent')
+			if not os.path.exists(ppath):
+				return None
+			self.__parent = task_pages(ppath, self.pid)
+
+		return self.__parent
+
+	def nr_pages(self):
+		"""
+		Returns the number of pages in this pages image.
+		"""
+		return len(self.pages) / PAGE_SIZE
+
+	def read(self, vaddr, length):
+		"""
+		Returns length bytes of task memory starting at vaddr.
+		Raises PagesException if any part of it is not dumped.
+		"""
+		data = []
+
+		while length > 0:
+			i = bisect.bisect_right(self.starts, vaddr) - 1
+			if i < 0 or vaddr >= self.ends[i]:
+				raise PagesException(vaddr)
+
+			n = min(length, self.ends[i] - vaddr)
+			if self.in_parent[i]:
+				parent = self.parent()
+				if not parent:
+					raise PagesException(vaddr)
+				data.append(parent.read(vaddr, n))
+			else:
+				off = self.offsets[i] + vaddr - self.starts[i]
+				data.append(self.pages[off:off + n])
+
+			vaddr += n
+			length -= n
+
+		return ''.join(data)
+
+	def close(self):
+		if self.pages:
+			self.pages.close()
+		if self.__parent:
+			self.__parent.close()
+
+def open(path, pid):
+	"""
+	Opens memory contents of task pid dumped in the images
+	directory path.
+	"""
+	return task_pages(path, pid)
@@ -122,155 +122,281 @@ def unmap_flags(value, flags_map):
 
 kern_minorbits = 20 # This is how kernel encodes dev_t in new format
 
-def decode_dev(field, value):
-	if _marked_as_odev(field):
+def _decode_dev(odev, value):
+	if odev:
 		return "%d:%d" % (os.major(value), os.minor(value))
 	else:
 		return "%d:%d" % (value >> kern_minorbits, value & ((1 << kern_minorbits) - 1))
 
-def encode_dev(field, value):
+def _encode_dev(odev, value):
 	dev = map(lambda x: int(x), value.split(':'))
-	if _marked_as_odev(field):
+	if odev:
 		return os.makedev(dev[0], dev[1])
 	else:
 		return dev[0] << kern_minorbits | dev[1]
 
+def decode_dev(field, value):
+	return _decode_dev(_marked_as_odev(field), value)
+
+def encode_dev(field, value):
+	return _encode_dev(_marked_as_odev(field), value)
+
 def is_string(value):
 	return isinstance(value, unicode) or isinstance(value, str)
 
-def _pb2dict_cast(field, value, pretty = False, is_hex = False):
+def _unsupported_field(field):
+	def conv(value):
+		raise Exception("Field(%s) has unsupported type %d" % (field.name, field.type))
+	return conv
+
+# Converting every field of a message requires looking at the field
+# type and at its criu options. Both never change, so for each message
+# DESCRIPTOR we build a plan once -- a converter closure for each of
+# its fields -- and keep it in these caches. Converting a message is
+# then just running the closures from its plan.
+_pb2dict_plans = {}
+_dict2pb_plans = {}
+
+def _pb2dict_cast(field, pretty = False, is_hex = False):
+	"""
+	Returns a closure, that converts a single value of the
+	given field to its dict(json) representation.
+	"""
 	if not is_hex:
 		is_hex = _marked_as_hex(field)
 
 	if field.type == FD.TYPE_MESSAGE:
-		return pb2dict(value, pretty, is_hex)
+		return lambda value: pb2dict(value, pretty, is_hex)
 	elif field.type == FD.TYPE_BYTES:
-		return value.encode('base64')
+		return lambda value: value.encode('base64')
 	elif field.type == FD.TYPE_ENUM:
-		return field.enum_type.values_by_number.get(value, None).name
+		by_number = field.enum_type.values_by_number
+		return lambda value: by_number.get(value, None).name
 	elif field.type in _basic_cast:
 		cast = _basic_cast[field.type]
 		if pretty and (cast == int or cast == long):
 			if is_hex:
 				# Fields that have (criu).hex = true option set
 				# should be stored in hex string format.
-				return "0x%x" % value
+				return lambda value: "0x%x" % value
 
 			if _marked_as_dev(field):
-				return decode_dev(field, value)
+				odev = _marked_as_odev(field)
+				return lambda value: _decode_dev(odev, value)
 
 			flags = _marked_as_flags(field)
 			if flags:
 				try:
 					flags_map = flags_maps[flags]
 				except:
-					return "0x%x" % value # flags are better seen as hex anyway
+					return lambda value: "0x%x" % value # flags are better seen as hex anyway
 				else:
-					return map_flags(value, flags_map)
+					return lambda value: map_flags(value, flags_map)
 
-		return cast(value)
+		return cast
 	else:
-		raise Exception("Field(%s) has unsupported type %d" % (field.name, field.type))
+		return _unsupported_field(field)
+
+def _pb2dict_ip(value):
+	if len(value) == 1:
+		v = socket.ntohl(value[0])
+		addr = ipaddr.IPv4Address(v)
+	else:
+		v = 0 +	(socket.ntohl(value[0]) << (32 * 3)) + \
+			(socket.ntohl(value[1]) << (32 * 2)) + \
+			(socket.ntohl(value[2]) << (32 * 1)) + \
+			(socket.ntohl(value[3]))
+		addr = ipaddr.IPv6Address(v)
+
+	return [addr.compressed]
+
+def _pb2dict_field(field, pretty, is_hex):
+	if field.label != FD.LABEL_REPEATED:
+		return _pb2dict_cast(field, pretty, is_hex)
+
+	if pretty and _marked_as_ip(field):
+		return _pb2dict_ip
+
+	cast = _pb2dict_cast(field, pretty, is_hex)
+	return lambda value: [cast(v) for v in value]
+
+def _pb2dict_plan(descriptor, pretty, is_hex):
+	key = (descriptor, pretty, is_hex)
+	plan = _pb2dict_plans.get(key)
+	if plan is None:
+		plan = {}
+		for field in descriptor.fields:
+			plan[field] = _pb2dict_field(field, pretty, is_hex)
+		_pb2dict_plans[key] = plan
+
+	return plan
+
+# Projections are trees of field names made of lists like
+# ['pid', 'tc.comm'], where None marks the field to be converted
+# as a whole, e.g. {'pid': None, 'tc': {'comm': None}}.
+_projections = {}
+
+def _projection(fields):
+	key = tuple(fields)
+	tree = _projections.get(key)
+	if tree is None:
+		tree = {}
+		for name in fields:
+			node = tree
+			path = name.split('.')
+			for n in path[:-1]:
+				if node.get(n, {}) is None:
+					break
+				node = node.setdefault(n, {})
+			else:
+				node[path[-1]] = None
+		_projections[key] = tree
+
+	return tree
+
+def _pb2dict_project(pb, pretty, is_hex, tree):
+	plan = _pb2dict_plan(pb.DESCRIPTOR, bool(pretty), bool(is_hex))
+	d = collections.OrderedDict() if pretty else {}
+	for field, value in pb.ListFields():
+		if field.name not in tree:
+			continue
+
+		sub = tree[field.name]
+		if sub is None or field.type != FD.TYPE_MESSAGE:
+			d[field.name] = plan[field](value)
+			continue
+
+		sub_hex = is_hex or _marked_as_hex(field)
+		if field.label == FD.LABEL_REPEATED:
+			d[field.name] = [_pb2dict_project(v, pretty, sub_hex, sub) for v in value]
+		else:
+			d[field.name] = _pb2dict_project(value, pretty, sub_hex, sub)
+	return d
 
-def pb2dict(pb, pretty = False, is_hex = False):
+def pb2dict(pb, pretty = False, is_hex = False, fields = None):
 	"""
 	Convert protobuf msg to dictionary.
 	Takes a protobuf message and returns a dict.
+	If fields list is given, only the fields named in it are
+	converted. Names of nested fields are dot-separated, e.g.
+	'tc.comm' for core_entry.
 	"""
+	if fields is not None:
+		return _pb2dict_project(pb, pretty, is_hex, _projection(fields))
+
+	plan = _pb2dict_plan(pb.DESCRIPTOR, bool(pretty), bool(is_hex))
 	d = collections.OrderedDict() if pretty else {}
 	for field, value in pb.ListFields():
-		if field.label == FD.LABEL_REPEATED:
-			d_val = []
-			if pretty and _marked_as_ip(field):
-				if len(value) == 1:
-					v = socket.ntohl(value[0])
-					addr = ipaddr.IPv4Address(v)
-				else:
-					v = 0 +	(socket.ntohl(value[0]) << (32 * 3)) + \
-						(socket.ntohl(value[1]) << (32 * 2)) + \
-						(socket.ntohl(value[2]) << (32 * 1)) + \
-						(socket.ntohl(value[3]))
-					addr = ipaddr.IPv6Address(v)
-
-				d_val.append(addr.compressed)
-			else:
-				for v in value:
-					d_val.append(_pb2dict_cast(field, v, pretty, is_hex))
-		else:
-			d_val = _pb2dict_cast(field, value, pretty, is_hex)
-
-		d[field.name] = d_val
+		d[field.name] = plan[field](value)
 	return d
 
-def _dict2pb_cast(field, value):
+def _dict2pb_cast(field):
+	"""
+	Returns a closure, that converts a single dict(json) value
+	of the given field to what protobuf expects.
+	"""
 	# Not considering TYPE_MESSAGE here, as repeated
 	# and non-repeated messages need special treatment
 	# in this case, and are hadled separately.
 	if field.type == FD.TYPE_BYTES:
-		return value.decode('base64')
+		return lambda value: value.decode('base64')
 	elif field.type == FD.TYPE_ENUM:
-		return field.enum_type.values_by_name.get(value, None).number
+		by_name = field.enum_type.values_by_name
+		return lambda value: by_name.get(value, None).number
 	elif field.type in _basic_cast:
 		cast = _basic_cast[field.type]
-		if (cast == int or cast == long) and is_string(value):
-			if _marked_as_dev(field):
-				return encode_dev(field, value)
-
-			flags = _marked_as_flags(field)
-			if flags:
-				try:
-					flags_map = flags_maps[flags]
-				except:
-					pass # Try to use plain string cast
-				else:
-					return unmap_flags(value, flags_map)
+		if not (cast == int or cast == long):
+			return cast
 
+		if _marked_as_dev(field):
+			odev = _marked_as_odev(field)
+			from_str = lambda value: _encode_dev(odev, value)
+		else:
 			# Some int or long fields might be stored as hex
 			# strings. See _pb2dict_cast.
-			return cast(value, 0)
-		else:
-			return cast(value)
+			from_str = lambda value: cast(value, 0)
+
+			flags = _marked_as_flags(field)
+			if flags in flags_maps:
+				flags_map = flags_maps[flags]
+				from_str = lambda value: unmap_flags(value, flags_map)
+
+		def conv(value):
+			if is_string(value):
+				return from_str(value)
+			else:
+				return cast(value)
+
+		return conv
 	else:
-		raise Exception("Field(%s) has unsupported type %d" % (field.name, field.type))
+		return _unsupported_field(field)
+
+def _dict2pb_ip(pb_val, value):
+	val = ipaddr.IPAddress(value[0])
+	if val.version == 4:
+		pb_val.append(socket.htonl(int(val)))
+	elif val.version == 6:
+		ival = int(val)
+		pb_val.append(socket.htonl((ival >> (32 * 3)) & 0xFFFFFFFF))
+		pb_val.append(socket.htonl((ival >> (32 * 2)) & 0xFFFFFFFF))
+		pb_val.append(socket.htonl((ival >> (32 * 1)) & 0xFFFFFFFF))
+		pb_val.append(socket.htonl((ival >> (32 * 0)) & 0xFFFFFFFF))
+	else:
+		raise Exception("Unknown IP address version %d" % val.version)
 
-def dict2pb(d, pb):
+def _dict2pb_field(field):
 	"""
-	Convert dictionary to protobuf msg.
-	Takes dict and protobuf message to be merged into.
+	Returns a closure, that puts dict(json) value of
+	the given field into protobuf message.
 	"""
-	for field in pb.DESCRIPTOR.fields:
-		if field.name not in d:
-			continue
-		value = d[field.name]
-		if field.label == FD.LABEL_REPEATED:
-			pb_val = getattr(pb, field.name, None)
-			if is_string(value[0]) and _marked_as_ip(field):
-				val = ipaddr.IPAddress(value[0])
-				if val.version == 4:
-					pb_val.append(socket.htonl(int(val)))
-				elif val.version == 6:
-					ival = int(val)
-					pb_val.append(socket.htonl((ival >> (32 * 3)) & 0xFFFFFFFF))
-					pb_val.append(socket.htonl((ival >> (32 * 2)) & 0xFFFFFFFF))
-					pb_val.append(socket.htonl((ival >> (32 * 1)) & 0xFFFFFFFF))
-					pb_val.append(socket.htonl((ival >> (32 * 0)) & 0xFFFFFFFF))
-				else:
-					raise Exception("Unknown IP address version %d" % val.version)
-				continue
+	name = field.name
 
-			for v in value:
-				if field.type == FD.TYPE_MESSAGE:
+	if field.label == FD.LABEL_REPEATED:
+		if field.type == FD.TYPE_MESSAGE:
+			def setter(pb, value):
+				pb_val = getattr(pb, name)
+				for v in value:
 					dict2pb(v, pb_val.add())
-				else:
-					pb_val.append(_dict2pb_cast(field, v))
-		else:
-			if field.type == FD.TYPE_MESSAGE:
-				# SetInParent method acts just like has_* = true in C,
-				# and helps to properly treat cases when we have optional
-				# field with empty repeated inside.
-				getattr(pb, field.name).SetInParent()
-
-				dict2pb(value, getattr(pb, field.name, None))
+			return setter
+
+		cast = _dict2pb_cast(field)
+		is_ip = _marked_as_ip(field)
+		def setter(pb, value):
+			pb_val = getattr(pb, name)
+			if is_ip and is_string(value[0]):
+				_dict2pb_ip(pb_val, value)
 			else:
-				setattr(pb, field.name, _dict2pb_cast(field, value))
+				pb_val.extend([cast(v) for v in value])
+		return setter
+
+	if field.type == FD.TYPE_MESSAGE:
+		def setter(pb, value):
+			# SetInParent method acts just like has_* = true in C,
+			# and helps to properly treat cases when we have optional
+			# field with empty repeated inside.
+			pb_val = getattr(pb, name)
+			pb_val.SetInParent()
+
+			dict2pb(value, pb_val)
+		return setter
+
+	cast = _dict2pb_cast(field)
+	return lambda pb, value: setattr(pb, name, cast(value))
+
+def _dict2pb_plan(descriptor):
+	plan = _dict2pb_plans.get(descriptor)
+	if plan is None:
+		plan = [(field.name, _dict2pb_field(field)) for field in descriptor.fields]
+		_dict2pb_plans[descriptor] = plan
+
+	return plan
+
+def dict2pb(d, pb):
+	"""
+	Convert dictionary to protobuf msg.
+	Takes dict and protobuf message to be merged into.
+	"""
+	for name, setter in _dict2pb_plan(pb.DESCRIPTOR):
+		if name in d:
+			setter(pb, d[name])
 	return pb
@@ -0,0 +1,407 @@
+# This file implements filtered scans over a directory of images.
+# A query looks like
+#
+#	IMAGE [where EXPR] [select FIELD, ...]
+#
+# IMAGE names the images to scan by the part of their file names
+# before the pid (or id), e.g. "fdinfo" stands for all fdinfo-*.img
+# files and "reg-files" for reg-files.img. Messages nested in image
+# entries are scanned by adding a path to them, e.g. "mm.vmas" scans
+# VMAs of all mm-*.img images.
+#
+# EXPR is made of comparisons of (dot-separated) fields of entries
+# with literals, joined with and, or and not, e.g.
+#
+#	prot & 2 and status & 0x40
+#	type == "INETSK" or fd in (0, 1, 2)
+#	name ~ "^/var/lib/x/"
+#
+# Fields are in the non-pretty pb2dict form, i.e. enums are compared
+# with their names and bytes are base64 strings. A comparison with a
+# repeated field is true if it is true for any of its values.
+#
+# Predicates are evaluated on values picked right from the protobuf
+# wire format, and only the entries that match are decoded further
+# into the selected fields, the rest are never converted to dicts.
+import io
+import os
+import re
+import struct
+import operator
+import itertools
+import multiprocessing
+
+import images
+import pb2dict
+from google.protobuf.descriptor import FieldDescriptor as FD
+
+class QueryException(Exception):
+	pass
+
+_tokens = re.compile(r'''\s*(?:
+	(?P<num>-?0[xX][0-9a-fA-F]+|-?\d+)|
+	(?P<str>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')|
+	(?P<op>==|!=|<=|>=|<|>|&|~|\(|\)|,|\*)|
+	(?P<name>[A-Za-z_][\w.-]*))''', re.X)
+
+def _tokenize(text):
+	toks = []
+	pos = 0
+	text = text.rstrip()
+	while pos < len(text):
+		m = _tokens.match(text, pos)
+		if not m:
+			raise QueryException("Bad query at: %s" % text[pos:])
+		pos = m.end()
+		kind = m.lastgroup
+		val = m.group(kind)
+		if kind == 'num':
+			val = int(val, 0)
+		elif kind == 'str':
+			val = val[1:-1].decode('string_escape')
+		toks.append((kind, val))
+	return toks
+
+def _regex(v, rx):
+	return rx.search(unicode(v)) is not None
+
+_cmp_ops = {
+	'==': operator.eq,
+	'!=': operator.ne,
+	'<':  operator.lt,
+	'<=': operator.le,
+	'>':  operator.gt,
+	'>=': operator.ge,
+	'&':  lambda v, l: isinstance(v, (int, long)) and v & l != 0,
+	'~':  _regex,
+}
+
+_literals = {'true': True, 'false': False}
+
+def _field_desc(descriptor, path):
+	"""
+	Returns the descriptor of the field, that the dot-separated
+	path leads to, starting from the message descriptor.
+	"""
+	field = None
+	for name in path.split('.'):
+		if descriptor is None:
+			raise QueryException("%s is not a message" % field.name)
+		field = descriptor.fields_by_name.get(name)
+		if field is None:
+			raise QueryException("No field %s in %s" % (name, descriptor.name))
+		descriptor = field.message_type
+	return field
+
+def _field_default(field):
+	if field.label == FD.LABEL_REPEATED or field.type == FD.TYPE_MESSAGE:
+		return None
+	return pb2dict._pb2dict_cast(field)(field.default_value)
+
+def _values(d, path, default):
+	"""
+	Returns the list of values the path leads to in the entry dict,
+	repeated fields on the way are flattened. Missing scalars are
+	taken as their default values.
+	"""
+	vals = [d]
+	for name in path:
+		nvals = []
+		for v in vals:
+			if name not in v:
+				continue
+			v = v[name]
+			if isinstance(v, list):
+				nvals.extend(v)
+			else:
+				nvals.append(v)
+		vals = nvals
+
+	if not vals and default is not None:
+		vals = [default]
+	return vals
+
+class _parser:
+	def __init__(self, toks, descriptor):
+		self.toks	= toks
+		self.pos	= 0
+		self.desc	= descriptor
+		self.fields	= set()
+
+	def peek(self):
+		if self.pos < len(self.toks):
+			return self.toks[self.pos]
+		return (None, None)
+
+	def next(self):
+		tok = self.peek()
+		self.pos += 1
+		return tok
+
+	def keyword(self, kw):
+		kind, val = self.peek()
+		if kind == 'name' and val.lower() == kw:
+			self.pos += 1
+			return True
+		return False
+
+	def expect(self, op):
+		kind, val = self.next()
+		if kind != 'op' or val != op:
+			raise QueryException("Expected %s, got %s" % (op, val))
+
+	def field(self):
+		kind, val = self.next()
+		if kind != 'name':
+			raise QueryException("Expected field name, got %s" % val)
+		_field_desc(self.desc, val)
+		return val
+
+	def literal(self):
+		kind, val = self.next()
+		if kind in ('num', 'str'):
+			return val
+		if kind == 'name':
+			# Bare words are enum names
+			return _literals.get(val.lower(), val)
+		raise QueryException("Expected literal, got %s" % val)
+
+	def expr(self):
+		e = self.and_expr()
+		while self.keyword('or'):
+			l, r = e, self.and_expr()
+			e = lambda d, l = l, r = r: l(d) or r(d)
+		return e
+
+	def and_expr(self):
+		e = self.not_expr()
+		while self.keyword('and'):
+			l, r = e, self.not_expr()
+			e = lambda d, l = l, r = r: l(d) and r(d)
+		return e
+
+	def not_expr(self):
+		if self.keyword('not'):
+			e = self.not_expr()
+			return lambda d: not e(d)
+		return self.atom()
+
+	def atom(self):
+		if self.peek() == ('op', '('):
+			self.next()
+			e = self.expr()
+			self.expect(')')
+			return e
+
+		name = self.field()
+		self.fields.add(name)
+		path = name.split('.')
+		default = _field_default(_field_desc(self.desc, name))
+
+		if self.keyword('in'):
+			self.expect('(')
+			lits = [self.literal()]
+			while self.peek() == ('op', ','):
+				self.next()
+				lits.append(self.literal())
+			self.expect(')')
+			return lambda d: any(v in lits
+					for v in _values(d, path, default))
+
+		kind, op = self.peek()
+		if kind != 'op' or op not in _cmp_ops:
+			# Bare field is true if set to non-zero
+			return lambda d: any(_values(d, path, default))
+
+		self.next()
+		lit = self.literal()
+		if op == '&' and (not isinstance(lit, (int, long)) or
+					isinstance(lit, bool)):
+			raise QueryException("%s & needs a number, got %r" % (name, lit))
+		if op == '~':
+			if not isinstance(lit, basestring):
+				raise QueryException("%s ~ needs a string, got %r" % (name, lit))
+			try:
+				lit = re.compile(unicode(lit))
+			except re.error as e:
+				raise QueryException("Bad regex %r: %s" % (lit, e))
+		cmp = _cmp_ops[op]
+		return lambda d: any(cmp(v, lit)
+				for v in _values(d, path, default))
+
+class query:
+	"""
+	Parsed query. Image is the name of the images to scan, path
+	is the list of nested message fields to scan within entries of
+	these images. The predicate and the selection are compiled
+	once the message type is known, i.e. on the first scan().
+	"""
+	def __init__(self, text):
+		toks = _tokenize(text)
+		if not toks or toks[0][0] != 'name':
+			raise QueryException("Query should start with image name")
+
+		spec = toks[0][1].split('.')
+		self.image	= spec[0]
+		self.path	= spec[1:]
+		self.regex	= re.compile(r'%s(-[0-9a-f]+)?\.img$' %
+						re.escape(self.image))
+		self.text	= text
+		self.__toks	= toks[1:]
+		self.__pred	= None
+		self.__plans	= None
+
+	def compile(self, descriptor):
+		"""
+		Compiles the predicate and plans to decode fields with
+		for entries of the given message descriptor.
+		"""
+		for name in self.path:
+			field = _field_desc(descriptor, name)
+			if field.type != FD.TYPE_MESSAGE:
+				raise QueryException("%s is not a message" % name)
+			descriptor = field.message_type
+
+		p = _parser(self.__toks, descriptor)
+		if p.keyword('where'):
+			self.__pred = p.expr()
+
+		sel = None
+		if p.keyword('select'):
+			if p.peek() == ('op', '*'):
+				p.next()
+			else:
+				sel = [p.field()]
+				while p.peek() == ('op', ','):
+					p.next()
+					sel.append(p.field())
+
+		if p.peek()[0] is not None:
+			raise QueryException("Unexpected %s" % p.peek()[1])
+
+		pred_plan = None
+		if self.__pred:
+			pred_plan = images._wire_plan(descriptor, sorted(p.fields))
+		self.__plans = (pred_plan, images._wire_plan(descriptor, sel))
+
+	def __items(self, buf, pos, end, path):
+		if not path:
+			yield buf, pos, end
+			return
+
+		num = path[0]
+		while pos < end:
+			key, pos = images._decode_varint(buf, pos)
+			if key >> 3 != num or key & 7 != 2:
+				pos = images._skip_field(buf, pos, key & 7)
+				continue
+
+			l, pos = images._decode_varint(buf, pos)
+			for item in self.__items(buf, pos, pos + l, path[1:]):
+				yield item
+			pos += l
+
+	def scan(self, f):
+		"""
+		Yields selected fields of entries of the image, that match
+		the predicate. F should be positioned at the image start.
+		"""
+		m = images.get_magic(f)
+		handler = images.handlers[m]
+		if isinstance(handler, images.raw_handler):
+			raise QueryException("Raw image %s can't be queried" % m)
+
+		if isinstance(handler, images.pagemap_handler):
+			# Skip pagemap_head, entries are pagemap_entry-s
+			size, = struct.unpack('i', f.read(4))
+			f.seek(size, 1)
+			payload = images.pagemap_entry
+			extra = None
+		else:
+			payload = handler.payload
+			extra = handler.extra_handler
+
+		descriptor = payload.DESCRIPTOR
+		if self.__plans is None:
+			self.compile(descriptor)
+		pred_plan, sel_plan = self.__plans
+
+		path = []
+		for name in self.path:
+			field = descriptor.fields_by_name[name]
+			path.append(field.number)
+			descriptor = field.message_type
+
+		while True:
+			buf = f.read(4)
+			if not buf:
+				break
+			size, = struct.unpack('i', buf)
+			buf = bytearray(f.read(size))
+
+			if extra:
+				pb = payload()
+				pb.ParseFromString(str(buf))
+				extra.skip(f, pb)
+
+			for b, pos, end in self.__items(buf, 0, len(buf), path):
+				if self.__pred and \
+				   not self.__pred(images._wire_decode(b, pred_plan, pos, end)):
+					continue
+				yield images._wire_decode(b, sel_plan, pos, end)
+
+	def files(self, path):
+		"""
+		Returns names of images in the directory, that are scanned.
+		Images with pids or ids in names are sorted by them.
+		"""
+		names = []
+		for name in os.listdir(path):
+			m = self.regex.match(name)
+			if not m:
+				continue
+			num = m.group(1)
+			names.append((num and int(num[1:], 16), name))
+
+		if not names:
+			raise QueryException("No %s images in %s" % (self.image, path))
+
+		names.sort()
+		return [name for num, name in names]
+
+_queries = {}
+
+def _scan_image(job):
+	path, name, text = job
+	q = _queries.get(text)
+	if q is None:
+		q = _queries[text] = query(text)
+
+	f = images.mmap_file(io.open(os.path.join(path, name), 'rb'))
+	return name, list(q.scan(f))
+
+def scan(path, text, jobs = 1):
+	"""
+	Runs the query over the images in the directory. Yields
+	(image name, entry) tuples for entries that match it, image
+	by image. With jobs > 1 images are scanned in parallel.
+	"""
+	q = query(text)
+	names = q.files(path)
+	work = [(path, name, text) for name in names]
+
+	if jobs > 1 and len(work) > 1:
+		pool = multiprocessing.Pool(min(jobs, len(work)))
+		results = pool.imap(_scan_image, work)
+	else:
+		pool = None
+		results = itertools.imap(_scan_image, work)
+
+	try:
+		for name, entries in results:
+			for e in entries:
+				yield name, e
+	finally:
+		if pool:
+			pool.terminate()
+			pool.join()
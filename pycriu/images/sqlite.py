@@ -0,0 +1,273 @@
+# This file exports a directory of images into an SQLite database,
+# so that questions about a checkpoint can be answered with SQL
+# instead of decoding images again and again.
+#
+# Every table is built from the fields of a protobuf message: scalar
+# fields become columns, non-repeated nested messages are flattened
+# into <field>_<subfield> columns, and repeated scalars are stored as
+# JSON lists. Repeated messages (like VMAs of mm) and per-task images
+# get tables of their own, with the pid (or other id from the image
+# file name) as a column, e.g.
+#
+#	pstree	 (pid, ppid, pgid, sid)
+#	threads	 (pid, tid)
+#	core	 (pid, <task_core_entry fields>)
+#	ids	 (pid, vm_id, files_id, ...)
+#	mm	 (pid, <mm_entry fields>)
+#	vmas	 (pid, start, end, ...)
+#	fdinfo	 (files_id, id, fd, type, ...)
+#	pagemap	 (pid, pages_id, vaddr, nr_pages, in_parent)
+#
+# plus reg_files, unixsk, inetsk, packetsk, netlinksk and mounts
+# (with mnt_ns_id) tables. Fields are in the non-pretty pb2dict form,
+# unset optional fields are NULL. SQLite integers are signed 64-bit,
+# so uint64 values from 2^63 up (e.g. the vsyscall VMA addresses) are
+# stored as their two's complement, i.e. negative.
+import io
+import os
+import re
+import json
+import sqlite3
+import itertools
+
+import images
+from google.protobuf.descriptor import FieldDescriptor as FD
+
+batch_size = 4096
+
+# Columns to index, if tables have them
+index_columns = ['pid', 'id', 'ino', 'vaddr']
+
+_sql_types = {
+	FD.TYPE_DOUBLE:		'REAL',
+	FD.TYPE_FLOAT:		'REAL',
+	FD.TYPE_STRING:		'TEXT',
+	FD.TYPE_BYTES:		'TEXT',
+	FD.TYPE_ENUM:		'TEXT',
+}
+
+def _columns(descriptor, prefix = ()):
+	"""
+	Returns (name, sql type, path, is_list) tuples for columns, that
+	fields of the message are stored in.
+	"""
+	cols = []
+	for field in descriptor.fields:
+		path = prefix + (field.name,)
+		rep = field.label == FD.LABEL_REPEATED
+		if field.type == FD.TYPE_MESSAGE:
+			if not rep:
+				cols += _columns(field.message_type, path)
+		elif rep:
+			cols.append(('_'.join(path), 'TEXT', path, True))
+		else:
+			cols.append(('_'.join(path),
+				_sql_types.get(field.type, 'INTEGER'), path, False))
+	return cols
+
+def _sql_int(v):
+	if isinstance(v, (int, long)) and v >= 1 << 63:
+		return v - (1 << 64)
+	return v
+
+def _value(d, path, is_list):
+	for name in path:
+		d = d.get(name)
+		if d is None:
+			return None
+	if is_list:
+		return json.dumps(d)
+	return _sql_int(d)
+
+class table:
+	"""
+	Table of messages found at the root path in entries of the
+	image. Key is the name of the column to put the number from
+	the image file name into, parents are the names of fields of
+	the entry itself to be stored along with each message. Fields
+	stored in tables of their own are listed in skip.
+	"""
+	def __init__(self, name, descriptor, root = (), key = None,
+			parents = (), value = None, skip = ()):
+		self.name	= name
+		self.root	= root
+		self.key	= key
+		self.parents	= parents
+		self.scalar	= descriptor is None
+		if self.scalar:
+			# Repeated scalar, stored in the value column
+			self.cols = [(value, 'INTEGER', (), False)]
+		else:
+			self.cols = [c for c in _columns(descriptor)
+					if c[2][0] not in skip]
+
+	def names(self):
+		names = list(self.parents)
+		if self.key:
+			names.insert(0, self.key)
+		return names + [c[0] for c in self.cols]
+
+	def create(self, db):
+		cols = [(n, 'INTEGER') for n in self.names()[:-len(self.cols)]]
+		cols += [(c[0], c[1]) for c in self.cols]
+		db.execute('CREATE TABLE %s (%s)' % (self.name,
+			', '.join('"%s" %s' % c for c in cols)))
+
+	def __items(self, d, path):
+		if not path:
+			yield d
+			return
+
+		v = d.get(path[0])
+		if v is None:
+			return
+		if not isinstance(v, list):
+			v = [v]
+		for i in v:
+			for item in self.__items(i, path[1:]):
+				yield item
+
+	def rows(self, entry, key):
+		head = [entry.get(p) for p in self.parents]
+		if self.key:
+			head.insert(0, key)
+
+		for item in self.__items(entry, self.root):
+			if self.scalar:
+				yield head + [_sql_int(item)]
+			else:
+				yield head + [_value(item, c[2], c[3]) for c in self.cols]
+
+	def insert(self, db, rows):
+		sql = 'INSERT INTO %s VALUES (%s)' % (self.name,
+				', '.join('?' * len(self.names())))
+		db.executemany(sql, rows)
+
+	def index(self, db):
+		for col in index_columns:
+			if col in self.names():
+				db.execute('CREATE INDEX %s_%s ON %s ("%s")' %
+					(self.name, col, self.name, col))
+
+#
+# Images to export: file name regex (with the key number in a group),
+# fields to decode and the tables to fill from their entries.
+#
+def _exports():
+	return [
+	(r'pstree\.img$', None, [
+		table('pstree', images.pstree_entry.DESCRIPTOR, skip = ('threads',)),
+		table('threads', None, ('threads',), parents = ('pid',), value = 'tid'),
+	]),
+	(r'core-(\d+)\.img$', ['tc'], [
+		table('core', images.task_core_entry.DESCRIPTOR, ('tc',), 'pid'),
+	]),
+	(r'ids-(\d+)\.img$', None, [
+		table('ids', images.task_kobj_ids_entry.DESCRIPTOR, key = 'pid'),
+	]),
+	(r'mm-(\d+)\.img$', None, [
+		table('mm', images.mm_entry.DESCRIPTOR, key = 'pid'),
+		table('vmas', images.vma_entry.DESCRIPTOR, ('vmas',), 'pid'),
+	]),
+	(r'fdinfo-(\d+)\.img$', None, [
+		table('fdinfo', images.fdinfo_entry.DESCRIPTOR, key = 'files_id'),
+	]),
+	(r'reg-files\.img$', None, [
+		table('reg_files', images.reg_file_entry.DESCRIPTOR),
+	]),
+	(r'unixsk\.img$', None, [
+		table('unixsk', images.unix_sk_entry.DESCRIPTOR),
+	]),
+	(r'inetsk\.img$', None, [
+		table('inetsk', images.inet_sk_entry.DESCRIPTOR),
+	]),
+	(r'packetsk\.img$', None, [
+		table('packetsk', images.packet_sock_entry.DESCRIPTOR),
+	]),
+	(r'netlinksk\.img$', None, [
+		table('netlinksk', images.netlink_sk_entry.DESCRIPTOR),
+	]),
+	(r'mountpoints-(\d+)\.img$', None, [
+		table('mounts', images.mnt_entry.DESCRIPTOR, key = 'mnt_ns_id'),
+	]),
+	]
+
+pagemap_cols = ['pid', 'pages_id', 'vaddr', 'nr_pages', 'in_parent']
+
+def _pagemap_rows(f, pid):
+	images.get_magic(f)
+	pages_id, cols = images.pagemap_handler().load_columns(f)
+	return itertools.izip(itertools.repeat(pid), itertools.repeat(pages_id),
+			itertools.imap(_sql_int, cols['vaddr']), cols['nr_pages'],
+			itertools.imap(bool, cols['in_parent']))
+
+def export(path, out):
+	"""
+	Exports images from the directory into a new SQLite
+	database file. Returns the list of tables created.
+	"""
+	if os.path.exists(out):
+		os.unlink(out)
+
+	db = sqlite3.connect(out)
+	# It's a one-off bulk load, nothing to recover if it fails
+	db.execute('PRAGMA journal_mode = OFF')
+	db.execute('PRAGMA synchronous = OFF')
+
+	exports = [(re.compile(rx), fields, tables)
+			for rx, fields, tables in _exports()]
+	for rx, fields, tables in exports:
+		for t in tables:
+			t.create(db)
+	db.execute('CREATE TABLE pagemap (%s)' %
+			', '.join('"%s" INTEGER' % c for c in pagemap_cols))
+
+	pm_rx = re.compile(r'pagemap-(\d+)\.img$')
+	pm_sql = 'INSERT INTO pagemap VALUES (%s)' % \
+			', '.join('?' * len(pagemap_cols))
+
+	for name in sorted(os.listdir(path)):
+		m = pm_rx.match(name)
+		if m:
+			f = images.mmap_file(io.open(os.path.join(path, name), 'rb'))
+			db.executemany(pm_sql, _pagemap_rows(f, int(m.group(1))))
+			continue
+
+		for rx, fields, tables in exports:
+			m = rx.match(name)
+			if m:
+				break
+		else:
+			continue
+
+		key = None
+		if m.groups():
+			key = int(m.group(1))
+
+		f = images.mmap_file(io.open(os.path.join(path, name), 'rb'))
+		entries = images.iter_load(f, fields = fields,
+				skip_extra = True)['entries']
+
+		# Rows are inserted in batches of batch_size
+		batches = [[] for t in tables]
+		for entry in entries:
+			for t, batch in zip(tables, batches):
+				batch.extend(t.rows(entry, key))
+				if len(batch) >= batch_size:
+					t.insert(db, batch)
+					del batch[:]
+
+		for t, batch in zip(tables, batches):
+			t.insert(db, batch)
+
+	names = ['pagemap']
+	for rx, fields, tables in exports:
+		for t in tables:
+			t.index(db)
+			names.append(t.name)
+	db.execute('CREATE INDEX pagemap_pid ON pagemap (pid)')
+	db.execute('CREATE INDEX pagemap_vaddr ON pagemap (vaddr)')
+
+	db.commit()
+	db.close()
+	return sorted(names)
@@ -0,0 +1,87 @@
+#!/bin/env python
+# Check that crit diff reports only the in_parent pages it can't read
+# as unknown and still compares the rest of the same pages chunk, and
+# that entries sharing ids (epoll targets, inotify watches, fanotify
+# marks) are not collapsed into one when matched.
+
+import pycriu
+import pycriu.images.diff
+import sys
+import os
+import shutil
+import tempfile
+
+from pycriu.images.pages import PAGE_SIZE
+
+vaddr = 0x400000
+
+tmp = tempfile.mkdtemp()
+
+def mkdir(name, pagemap, pages):
+	path = os.path.join(tmp, name)
+	os.mkdir(path)
+	pycriu.images.dump({'magic': 'PAGEMAP', 'entries':
+		[{'pages_id': 1}] + pagemap},
+		open(os.path.join(path, 'pagemap-1.img'), 'wb'))
+	open(os.path.join(path, 'pages-1.img'), 'wb').write(
+		''.join(c * PAGE_SIZE for c in pages))
+	return path
+
+# The second page is modified, the last two are in the parent
+# images, which are not there
+a = mkdir('a', [{'vaddr': vaddr, 'nr_pages': 4}], 'abcd')
+b = mkdir('b', [{'vaddr': vaddr, 'nr_pages': 2},
+		{'vaddr': vaddr + 2 * PAGE_SIZE, 'nr_pages': 2,
+		 'in_parent': True}], 'aX')
+
+fail = False
+
+d = pycriu.images.diff.diff(a, b)['changed'].get('pagemap-1.img', {})
+exp = {
+	'modified':	[[vaddr + PAGE_SIZE, vaddr + 2 * PAGE_SIZE]],
+	'unknown':	[[vaddr + 2 * PAGE_SIZE, vaddr + 4 * PAGE_SIZE]],
+}
+for k in exp:
+	if d.get(k) != exp[k]:
+		print "pagemap %s: %s, expected %s" % (k, d.get(k), exp[k])
+		fail = True
+
+# Targets of one eventpoll file share its id, the second is changed
+a_tfd = [{'id': 1, 'tfd': 3, 'events': 1, 'data': 0},
+	 {'id': 1, 'tfd': 4, 'events': 1, 'data': 0}]
+b_tfd = [{'id': 1, 'tfd': 3, 'events': 1, 'data': 0},
+	 {'id': 1, 'tfd': 4, 'events': 5, 'data': 0}]
+
+# Watches of one inotify, one is removed
+a_wd = [{'id': 2, 'wd': 1, 'i_ino': 10}, {'id': 2, 'wd': 2, 'i_ino': 11}]
+b_wd = [{'id': 2, 'wd': 1, 'i_ino': 10}]
+
+# Marks of one fanotify have no key but the id, so are compared
+# by position
+a_mark = [{'id': 3, 'mask': 1}, {'id': 3, 'mask': 2}]
+b_mark = [{'id': 3, 'mask': 1}, {'id': 3, 'mask': 4}]
+
+checks = [
+	('EVENTPOLL_TFD', a_tfd, b_tfd, {'key': ('id', 'tfd'),
+		'added': [], 'removed': [], 'changed': [{'key': (1, 4),
+			'fields': {'events': [1, 5]}}]}),
+	('INOTIFY_WD', a_wd, b_wd, {'key': ('id', 'wd'),
+		'added': [], 'removed': [a_wd[1]], 'changed': []}),
+	('FANOTIFY_MARK', a_mark, b_mark, {'key': 'index',
+		'added': [], 'removed': [], 'changed': [{'key': 1,
+			'fields': {'mask': [2, 4]}}]}),
+]
+
+for m, ea, eb, exp in checks:
+	d = pycriu.images.diff._entries_diff(m, ea, eb)
+	if d != exp:
+		print "%s: %s, expected %s" % (m, d, exp)
+		fail = True
+
+shutil.rmtree(tmp)
+
+if fail:
+	print "FAIL"
+	sys.exit(1)
+
+print "PASS"
@@ -0,0 +1,68 @@
+#!/bin/env python
+# Check that crit query matches fields of entries, including unset
+# optional fields with non-zero (e.g. negative sint) defaults, and
+# gives the same results when images are scanned in parallel.
+
+import pycriu
+import pycriu.images.query
+import sys
+import os
+import shutil
+import tempfile
+
+tmp = tempfile.mkdtemp()
+
+fown = {'uid': 0, 'euid': 0, 'signum': 0, 'pid_type': 0, 'pid': 0}
+
+pycriu.images.dump({'magic': 'REG_FILES', 'entries': [
+	{'id': 1, 'flags': 0, 'pos': 0, 'fown': fown, 'name': '/a'},
+	{'id': 2, 'flags': 0, 'pos': 0, 'fown': fown, 'name': '/b', 'mnt_id': 5},
+	{'id': 3, 'flags': 2, 'pos': 0, 'fown': fown, 'name': '/var/c', 'mnt_id': -1}]},
+	open(os.path.join(tmp, 'reg-files.img'), 'wb'))
+
+for pid in (1, 2):
+	pycriu.images.dump({'magic': 'FDINFO', 'entries': [
+		{'id': 1, 'flags': 0, 'type': 'REG', 'fd': 0},
+		{'id': 2, 'flags': 1, 'type': 'REG', 'fd': 3 + pid},
+		{'id': 3, 'flags': 0, 'type': 'INETSK', 'fd': 10}]},
+		open(os.path.join(tmp, 'fdinfo-%d.img' % pid), 'wb'))
+
+def ids(text, jobs = 1):
+	return [(name, e['id']) for name, e in
+		pycriu.images.query.scan(tmp, text + ' select id', jobs)]
+
+checks = [
+	('reg-files where mnt_id == -1', 1,
+		[('reg-files.img', 1), ('reg-files.img', 3)]),
+	('reg-files where mnt_id != -1', 1, [('reg-files.img', 2)]),
+	('reg-files where flags & 2 and name ~ "^/var/"', 1, [('reg-files.img', 3)]),
+	('fdinfo where type == INETSK or fd in (4, 5)', 2,
+		[('fdinfo-1.img', 2), ('fdinfo-1.img', 3),
+		 ('fdinfo-2.img', 2), ('fdinfo-2.img', 3)]),
+	('fdinfo where not flags', 2,
+		[('fdinfo-1.img', 1), ('fdinfo-1.img', 3),
+		 ('fdinfo-2.img', 1), ('fdinfo-2.img', 3)]),
+]
+
+fail = False
+for text, jobs, exp in checks:
+	for j in set((1, jobs)):
+		res = ids(text, j)
+		if res != exp:
+			print "%s (jobs %d): %s, expected %s" % (text, j, res, exp)
+			fail = True
+
+try:
+	ids('reg-files where flags & "x"')
+	print "flags & \"x\": no error"
+	fail = True
+except pycriu.images.query.QueryException:
+	pass
+
+shutil.rmtree(tmp)
+
+if fail:
+	print "FAIL"
+	sys.exit(1)
+
+print "PASS"
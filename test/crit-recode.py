@@ -4,6 +4,11 @@ import pycriu
 import sys
 import os
 import subprocess
+import shutil
+import tempfile
+import imp
+import json
+import StringIO
 
 find = subprocess.Popen(['find', 'test/dump/', '-name', '*.img'],
 		stdout = subprocess.PIPE)
@@ -12,7 +17,8 @@ test_pass = True
 
 def recode_and_check(imgf, o_img, pretty):
 	try:
-		pb = pycriu.images.loads(o_img, pretty)
+		# Load from the file, raw images are told by their names
+		pb = pycriu.images.load(open(imgf, 'rb'), pretty)
 	except pycriu.images.MagicException as me:
 		print "%s magic %x error" % (imgf, me.magic)
 		return False
@@ -32,33 +38,88 @@ def recode_and_check(imgf, o_img, pretty):
 
 	return True
 
+# Other modes of crit decode/encode: decode turns the image file into
+# something, that encode turns back into the image binary
+def recode_mode(imgf, o_img, mode, decode, encode):
+	try:
+		x = decode(imgf)
+	except pycriu.images.MagicException as me:
+		print "%s magic %x error" % (imgf, me.magic)
+		return False
+	except:
+		print "%s %s decode fails" % (imgf, mode)
+		return False
+
+	try:
+		r_img = encode(x)
+	except:
+		print "%s %s encode fails" % (imgf, mode)
+		return False
+
+	if o_img != r_img:
+		print "%s %s recode mismatch" % (imgf, mode)
+		return False
+
+	return True
+
+blobs_dir = tempfile.mkdtemp()
+
+def blobs_decode(imgf):
+	bl = pycriu.images.dir_blobs(blobs_dir, os.path.basename(imgf))
+	return pycriu.images.load(open(imgf, 'rb'), blobs = bl)
+
+def blobs_encode(img):
+	return pycriu.images.dumps(img, pycriu.images.dir_blobs(blobs_dir))
+
+crit = imp.load_source('crit', os.path.join(os.path.dirname(sys.argv[0]), '..', 'crit'))
+
+# Streamed json must be the same text json.dump() makes of the
+# whole image, and is read back in small chunks to make the reader
+# resume values split between them
+def stream_decode(imgf):
+	img = pycriu.images.iter_load(pycriu.images.mmap_file(open(imgf, 'rb')))
+	f = StringIO.StringIO()
+	crit.json_dump_image(img, f)
+	if f.getvalue() != json.dumps(pycriu.images.load(open(imgf, 'rb'))):
+		raise Exception("streamed json differs")
+	return f.getvalue()
+
+def stream_encode(text):
+	reader = crit.json_image_reader(StringIO.StringIO(text))
+	reader.chunk_size = 64
+	return pycriu.images.dumps(reader.load())
+
+# Bin-dict keeps binary data of extras as is, as crit does it
+def bindict_decode(imgf):
+	img = pycriu.images.iter_load(open(imgf, 'rb'),
+			blobs = pycriu.images.raw_blobs())
+	f = StringIO.StringIO()
+	pycriu.images.bindict.dump(img, f)
+	return f.getvalue()
+
+def bindict_encode(data):
+	img = pycriu.images.bindict.iter_load(StringIO.StringIO(data))
+	return pycriu.images.dumps(img, pycriu.images.raw_blobs())
+
+modes = [
+	('blobs-dir', blobs_decode, blobs_encode),
+	('streaming', stream_decode, stream_encode),
+	('bin-dict', bindict_decode, bindict_encode),
+]
 
 for imgf in find.stdout.readlines():
 	imgf = imgf.strip()
-	imgf_b = os.path.basename(imgf)
-
-	if imgf_b.startswith('pages-'):
-		continue
-	if imgf_b.startswith('iptables-'):
-		continue
-	if imgf_b.startswith('ip6tables-'):
-		continue
-	if imgf_b.startswith('route-'):
-		continue
-	if imgf_b.startswith('route6-'):
-		continue
-	if imgf_b.startswith('ifaddr-'):
-		continue
-	if imgf_b.startswith('tmpfs-'):
-		continue
-
 	o_img = open(imgf).read()
 	if not recode_and_check(imgf, o_img, False):
 		test_pass = False
 	if not recode_and_check(imgf, o_img, True):
 		test_pass = False
+	for mode, decode, encode in modes:
+		if not recode_mode(imgf, o_img, mode, decode, encode):
+			test_pass = False
 
 find.wait()
+shutil.rmtree(blobs_dir)
 
 if not test_pass:
 	print "FAIL"
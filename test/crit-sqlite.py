@@ -0,0 +1,53 @@
+#!/bin/env python
+# Check that crit sqlite exports uint64 values, that don't fit into
+# signed SQLite integers, e.g. the vsyscall VMA and full sigsets.
+
+import pycriu
+import pycriu.images.sqlite
+import sys
+import os
+import shutil
+import sqlite3
+import tempfile
+
+vsyscall = 0xffffffffff600000
+sigset = 0xfffffffe7ffbfeff
+
+def s64(v):
+	return v - (1 << 64)
+
+tmp = tempfile.mkdtemp()
+imgs = os.path.join(tmp, 'imgs')
+os.mkdir(imgs)
+
+pycriu.images.dump({'magic': 'MM', 'entries': [{
+	'mm_start_code': 0, 'mm_end_code': 0, 'mm_start_data': 0,
+	'mm_end_data': 0, 'mm_start_stack': 0, 'mm_start_brk': 0,
+	'mm_brk': 0, 'mm_arg_start': 0, 'mm_arg_end': 0,
+	'mm_env_start': 0, 'mm_env_end': 0, 'exe_file_id': 0,
+	'vmas': [{'start': vsyscall, 'end': vsyscall + 4096, 'pgoff': 0,
+		'shmid': 0, 'prot': 4, 'flags': 0x22, 'status': 0x209,
+		'fd': -1}]}]},
+	open(os.path.join(imgs, 'mm-1.img'), 'wb'))
+
+pycriu.images.dump({'magic': 'CORE', 'entries': [{
+	'mtype': 'X86_64',
+	'tc': {'task_state': 1, 'exit_code': 0, 'personality': 0,
+		'flags': 0, 'blk_sigset': sigset, 'comm': 'test'}}]},
+	open(os.path.join(imgs, 'core-1.img'), 'wb'))
+
+out = os.path.join(tmp, 'out.db')
+pycriu.images.sqlite.export(imgs, out)
+
+db = sqlite3.connect(out)
+vma = db.execute('SELECT start, "end" FROM vmas WHERE pid = 1').fetchall()
+blk = db.execute('SELECT blk_sigset FROM core WHERE pid = 1').fetchall()
+db.close()
+shutil.rmtree(tmp)
+
+if vma != [(s64(vsyscall), s64(vsyscall + 4096))] or blk != [(s64(sigset),)]:
+	print "vmas %s, core %s" % (vma, blk)
+	print "FAIL"
+	sys.exit(1)
+
+print "PASS"
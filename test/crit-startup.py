@@ -0,0 +1,62 @@
+#!/bin/env python
+#
+# Measures how long single-image crit commands take, which is mostly
+# python startup and imports. For comparison the time of importing
+# pycriu with all the _pb2 modules loaded (as it was before they got
+# imported lazily) is shown too.
+#
+# Usage: crit-startup.py DIR [RUNS]
+#
+import sys
+import os
+import time
+import subprocess
+
+import pycriu
+
+crit = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'crit')
+
+eager_import = "import pycriu; " \
+	"[m.resolve() for m in vars(pycriu.images.pb).values() " \
+	"if isinstance(m, pycriu.images.lazypb.lazy_pb)]"
+
+def best_of(cmd, runs):
+	best = None
+	devnull = open(os.devnull, 'w')
+	for i in xrange(runs):
+		start = time.time()
+		subprocess.check_call(cmd, stdout = devnull)
+		took = time.time() - start
+		if best is None or took < best:
+			best = took
+	devnull.close()
+	return best
+
+def main(argv):
+	if len(argv) < 2:
+		print "Usage: %s DIR [RUNS]" % argv[0]
+		return 1
+
+	imgs = argv[1]
+	runs = len(argv) > 2 and int(argv[2]) or 10
+	pstree = os.path.join(imgs, 'pstree.img')
+	pid = pycriu.images.load(open(pstree, 'rb'))['entries'][0]['pid']
+	core = os.path.join(imgs, 'core-%d.img' % pid)
+
+	benches = [
+		('python startup',		[sys.executable, '-c', 'pass']),
+		('import pycriu',		[sys.executable, '-c', 'import pycriu']),
+		('import pycriu, all pb',	[sys.executable, '-c', eager_import]),
+		('crit info pstree',		[sys.executable, crit, 'info', pstree]),
+		('crit decode pstree',		[sys.executable, crit, 'decode', '-i', pstree]),
+		('crit decode core',		[sys.executable, crit, 'decode', '-i', core]),
+		('crit x ps',			[sys.executable, crit, 'x', imgs, 'ps']),
+	]
+
+	for name, cmd in benches:
+		print "%-28s%8.1f ms" % (name, best_of(cmd, runs) * 1000)
+
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main(sys.argv))
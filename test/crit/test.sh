@@ -22,5 +22,27 @@ do
 	echo "  -- cmp"
 	cmp $x "$x"".json.img" || _exit $?
 
+	echo "  -- to json, streamed from file to file"
+	../../crit decode -i $x -o "$x"".stream.json" || _exit $?
+	echo "  -- to img, streamed from file to file"
+	../../crit encode -i "$x"".stream.json" -o "$x"".stream.img" || _exit $?
+	echo "  -- cmp"
+	cmp $x "$x"".stream.img" || _exit $?
+
+	echo "  -- to bin-dict"
+	../../crit decode -i $x -o "$x"".bd" --format bin-dict || _exit $?
+	echo "  -- to img, from bin-dict"
+	../../crit encode -i "$x"".bd" -o "$x"".bd.img" --format bin-dict || _exit $?
+	echo "  -- cmp"
+	cmp $x "$x"".bd.img" || _exit $?
+
+	echo "  -- to json, extras to blobs"
+	mkdir -p blobs
+	../../crit decode -i $x -o "$x"".blobs.json" --blobs-dir blobs || _exit $?
+	echo "  -- to img, extras from blobs"
+	../../crit encode -i "$x"".blobs.json" -o "$x"".blobs.img" --blobs-dir blobs || _exit $?
+	echo "  -- cmp"
+	cmp $x "$x"".blobs.img" || _exit $?
+
 	echo "=== done"
 done
@@ -4,4 +4,7 @@ source `dirname $0`/criu-lib.sh
 prep
 ./test/zdtm.py run --all -f best -x maps04 -x cgroup02 --norst --keep always || fail
 PYTHONPATH="$(pwd)" ./test/crit-recode.py || fail
+PYTHONPATH="$(pwd)" ./test/crit-sqlite.py || fail
+PYTHONPATH="$(pwd)" ./test/crit-query.py || fail
+PYTHONPATH="$(pwd)" ./test/crit-diff.py || fail
 exit 0